@@ -1,27 +1,168 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Request, render_template, request, jsonify, send_file, url_for, redirect, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json, execute_values
 import os
+import io
 import socket
-from werkzeug.utils import secure_filename
+import base64
+import select
+import hashlib
+import gzip
+import tempfile
+import shutil
+import mimetypes
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import safe_join
+from werkzeug.http import http_date
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser, MultiPartParser
 import uuid
 import time
-from datetime import datetime
+import threading
+from collections import Counter, deque, namedtuple, OrderedDict
+from contextlib import contextmanager
+import json
+from datetime import date, datetime
+from storage import LocalStorage, NFSStorage, S3Storage
+
+try:
+    import brotli  # optional: adds a br variant to pre-serialized responses
+except ImportError:
+    brotli = None
+
+try:
+    import orjson  # optional: fast JSON backend
+except ImportError:
+    orjson = None
+
+try:
+    from PIL import Image, ImageOps, features  # optional: resized image variants
+except ImportError:
+    Image = None
 
 hostname = socket.gethostname()
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Consistency-Token', 'X-Next-Cursor', 'X-Prev-Cursor', 'Link'])
 
 # -------- Configuration --------
+# where image bytes live: 'local' (a directory on this VM), 'nfs' (the shared
+# export mounted at UPLOAD_FOLDER on every VM) or 's3' (an S3-compatible
+# object store such as MinIO; needs boto3)
+STORAGE_BACKEND = 'nfs'
 UPLOAD_FOLDER = '/mnt/shared/images'
+S3_BUCKET = 'welcome-images'
+S3_PREFIX = 'images/'
+S3_ENDPOINT_URL = None  # e.g. 'http://192.168.104.30:9000' for MinIO; None for AWS
+S3_REGION = None
+S3_ACCESS_KEY = None  # None: boto3's usual credential chain (env, ~/.aws, instance role)
+S3_SECRET_KEY = None
+S3_PRESIGN_EXPIRES = 3600  # seconds a presigned image URL stays valid
+# file storage layout: 'sharded' stores <name[0:2]>/<name[2:4]>/<name> so NFS
+# directories stay small; 'flat' keeps every image directly in UPLOAD_FOLDER
+STORAGE_LAYOUT = 'sharded'
+# also find images still stored flat; set to False once migrate_layout.py has finished
+STORAGE_FLAT_FALLBACK = True
+# upload temp files; None: UPLOAD_FOLDER/INCOMING_DIR, or a local dir for s3.
+# Resumable uploads spread over several VMs need this on shared storage.
+STORAGE_STAGING_DIR = None
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+INCOMING_DIR = '.incoming'  # upload temp files, inside the upload folder so renames are atomic
+# resumable uploads (/api/uploads): chunks are written in place into one staging file
+RESUMABLE_MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # suggested to clients
+UPLOAD_CHUNK_MAX = 8 * 1024 * 1024  # largest body accepted per PUT
+UPLOAD_SESSION_TTL = 24 * 3600  # seconds without progress before a session is discarded
+# batch import (/api/content/batch): multipart quote/image pairs or a zip + manifest.json
+BATCH_MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # 1GB per request
+BATCH_MAX_ITEMS = 10000
+BATCH_MAX_FILES = 500  # multipart batches keep one open file per image; use a zip beyond this
+BATCH_WRITE_WORKERS = 8  # threads extracting/fsyncing/renaming images in parallel
+# files orphaned by deletes are unlinked after commit, off the request thread
+FILE_CLEANUP_WORKERS = 4
+FILE_CLEANUP_CHUNK = 100  # files claimed and unlinked per cleanup transaction
+BULK_DELETE_MAX_ROWS = 10000  # ids per request, and rows deleted per request by a filter
+# name uploads after their SHA-256 so identical images are stored once;
+# the images table counts how many content rows reference each file
+CONTENT_ADDRESSED_STORAGE = True
+# stored image names are never reused for other bytes, so browsers may keep them forever
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600  # seconds
+# per-node read-through copy of the NFS images on local disk (None disables)
+LOCAL_IMAGE_CACHE_DIR = '/var/cache/welcome_app/images'
+LOCAL_IMAGE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2GB for the directory, shared by all worker processes
+LOCAL_IMAGE_CACHE_RESCAN = 30  # seconds between re-reads of the directory's real usage (on misses)
+IMAGE_CHANNEL = 'image_deleted'  # NOTIFY channel telling other nodes to drop a cached image
+# how image bytes leave the process:
+# 'wsgi'             - file handed to the server's wsgi.file_wrapper (sendfile under gunicorn)
+# 'x-sendfile'       - empty response with X-Sendfile: <path> for Apache/lighttpd to serve
+# 'x-accel-redirect' - empty response with X-Accel-Redirect to an nginx internal location
+# 'redirect'         - 302 to a presigned object store URL (s3 only)
+# With s3, images not in the local image cache are otherwise streamed through the app.
+IMAGE_DELIVERY = 'wsgi'
+X_ACCEL_UPLOAD_PREFIX = '/_protected/uploads/'  # nginx internal location aliasing UPLOAD_FOLDER
+X_ACCEL_CACHE_PREFIX = '/_protected/image-cache/'  # ... and LOCAL_IMAGE_CACHE_DIR
+
+app.config['USE_X_SENDFILE'] = IMAGE_DELIVERY == 'x-sendfile'
+
+# resized copies generated by the worker (needs Pillow): name -> max width in px.
+# Each is written in the original's format plus VARIANT_FORMATS the worker's
+# Pillow can encode, as <original>.<variant>.<format> next to the original.
+IMAGE_VARIANTS = {'thumb': 300, '1280w': 1280, '1920w': 1920}
+VARIANT_FORMATS = ('webp', 'avif')
+VARIANT_QUALITY = 82
+# a negotiated format found missing (the worker could not encode AVIF, say)
+# is not looked up in storage again for this long, per process
+MISSING_VARIANT_TTL = 600  # seconds
+MISSING_VARIANT_MAX_ENTRIES = 10000
+PLACEHOLDER_SIZE = 16  # px, longest side of the inline blurred preview (LQIP)
+
+# post-upload job queue (jobs table), drained by worker.py on each VM
+JOB_CHANNEL = 'job_queued'
+JOB_POLL_INTERVAL = 5  # seconds; NOTIFY wakes workers sooner
+JOB_LEASE = 300  # seconds a claimed job may run before another worker retries it
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 30  # seconds, multiplied by the attempt number
+JOB_WORKER_THREADS = 2  # per worker.py process
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
-# DB nodes (primary first is preferred for writes)
+# /api/content listing
+CONTENT_FIELDS = ('id', 'quote', 'image_filename', 'created_at', 'image_url', 'variants', 'processing_state',
+                  'width', 'height', 'byte_size', 'dominant_color', 'placeholder')
+DEFAULT_PAGE_SIZE = 50  # used when after/before is given without limit
+MAX_PAGE_SIZE = 500
+STREAM_ITERSIZE = 1000  # rows fetched per round trip by ?stream=1
+
+# welcome page rotation (/api/rotation)
+ROTATION_INTERVAL = 10  # seconds each quote stays on screen
+ROTATION_MANIFEST_SIZE = 10  # upcoming items per manifest
+ROTATION_MAX_MANIFEST_SIZE = 50
+ROTATION_PRELOAD = 2  # first items hinted with Link: rel=preload on the welcome page
+ROTATION_FIELDS = ('id', 'quote', 'image_url', 'variants', 'width', 'height', 'dominant_color', 'placeholder')
+
+# in-process cache of serialized /api/content responses, invalidated on writes
+# here and on other app nodes (PostgreSQL LISTEN/NOTIFY on CONTENT_CHANNEL)
+CONTENT_CACHE_TTL = 60  # seconds; safety net, invalidation is push based
+CONTENT_CACHE_MAX_ENTRIES = 256
+CONTENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CONTENT_CHANNEL = 'content_changed'
+LISTENER_RETRY_DELAY = 2  # seconds between reconnect attempts
+# cached listings are kept pre-compressed; tiny bodies are not worth it, and
+# bodies too big to cache are sent uncompressed rather than recompressed per request
+COMPRESS_MIN_SIZE = 1024  # bytes
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# JSON encoder used by jsonify and the cached/streamed listings:
+# 'orjson', 'stdlib' or 'auto' (orjson when installed)
+JSON_BACKEND = 'auto'
+
+# DB nodes (primary first is preferred for writes).
+# Optional 'weight' sets a node's share of reads when READ_ROUTING balances them.
 DB_CONFIGS = [
     {
         'dbname': 'welcome_app',
@@ -40,11 +181,45 @@ DB_CONFIGS = [
 ]
 
 # runtime state
-current_db_index = 0
 CONNECT_TIMEOUT = 3  # seconds
 FAILOVER_RETRY_DELAY = 0.5  # seconds between attempts
 MAX_FAILOVER_ATTEMPTS = 3
 
+# connection pool sizing (per DB node, per process)
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 10
+POOL_CHECKOUT_TIMEOUT = 5  # seconds to wait for a free connection
+POOL_IDLE_TIMEOUT = 300  # seconds before surplus idle connections are closed
+POOL_VALIDATE_AFTER = 5  # seconds idle before a connection is pinged on checkout
+
+# background topology monitor
+TOPOLOGY_PROBE_INTERVAL = 2  # seconds between probes of every DB node
+TOPOLOGY_STALE_AFTER = 3 * TOPOLOGY_PROBE_INTERVAL  # older role maps are not trusted
+# probe connections give up on a vanished host within PROBE_TIMEOUT instead
+# of waiting for kernel retransmits, which can take many minutes
+PROBE_TIMEOUT = 2  # seconds (libpq's minimum connect_timeout)
+PROBE_CONNECT_OPTIONS = {
+    'connect_timeout': PROBE_TIMEOUT,
+    'keepalives': 1,
+    'keepalives_idle': 1,
+    'keepalives_interval': 1,
+    'keepalives_count': PROBE_TIMEOUT,
+    'tcp_user_timeout': PROBE_TIMEOUT * 1000,  # ms
+    'options': f'-c statement_timeout={PROBE_TIMEOUT * 1000}'
+}
+
+# read routing: 'primary' (primary first, replicas only on failure),
+# 'round_robin' (weighted round-robin over healthy nodes) or
+# 'least_outstanding' (node with the fewest checked-out connections per weight)
+READ_ROUTING = 'round_robin'
+MAX_REPLICA_LAG = 5  # seconds; lagging replicas are excluded from read routing
+
+# read-your-writes: writes hand out the primary's WAL position as a token and
+# reads carrying it are only served by nodes that have replayed that far
+CONSISTENCY_HEADER = 'X-Consistency-Token'
+CONSISTENCY_COOKIE = 'consistency_token'
+CONSISTENCY_TOKEN_TTL = 60  # seconds the cookie is kept by the browser
+
 # -------- Utilities --------
 def log(msg):
     print(f"[{datetime.utcnow().isoformat()}] {msg}")
@@ -52,16 +227,84 @@ def log(msg):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# -------- JSON encoding --------
+def _json_default(obj):
+    # datetimes as ISO 8601, the same text orjson produces natively
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+class AppJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider with a selectable backend.
+
+    'orjson' serializes datetime, dict subclasses such as RealDictRow and
+    tuples natively and writes bytes straight into the response; 'stdlib'
+    uses json.dumps with the same output for those types. Keys are sorted,
+    non-ASCII text is written as UTF-8 and separators are compact either
+    way, so cached bodies and ETags do not depend on the backend.
+    """
+
+    default = staticmethod(_json_default)
+    ensure_ascii = False  # orjson never escapes non-ASCII
+
+    def __init__(self, app, backend=JSON_BACKEND):
+        super().__init__(app)
+        if backend == 'auto':
+            backend = 'orjson' if orjson is not None else 'stdlib'
+        if backend == 'orjson' and orjson is None:
+            log("✗ JSON_BACKEND is 'orjson' but orjson is not installed — using stdlib")
+            backend = 'stdlib'
+        self.backend = backend
+
+    def _orjson_options(self, pretty=False):
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if self.backend == 'orjson' and not kwargs:
+            return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode()
+        if 'indent' not in kwargs:
+            kwargs.setdefault('separators', (',', ':'))
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.backend == 'orjson' and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if self.backend != 'orjson':
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_options(pretty)) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app.json = AppJSONProvider(app)
+
 # -------- DB connection / failover logic --------
-def _connect_to_node(index):
+class NodeConnection(psycopg2.extensions.connection):
+    """
+    psycopg2 connection that remembers which DB_CONFIGS entry it belongs to.
+    """
+    node_index = None
+
+def _connect_to_node(index, **options):
     """
     Try to connect to DB_CONFIGS[index]. Returns a psycopg2 connection or raises.
+    options are extra libpq parameters (timeouts, keepalives).
     """
-    cfg = DB_CONFIGS[index].copy()
+    cfg = {k: v for k, v in DB_CONFIGS[index].items() if k != 'weight'}
     cfg['connect_timeout'] = CONNECT_TIMEOUT
     # optional: set application_name to help logs
     cfg['application_name'] = 'welcome_app_flask'
-    return psycopg2.connect(**cfg)
+    cfg.update(options)
+    conn = psycopg2.connect(connection_factory=NodeConnection, **cfg)
+    conn.node_index = index
+    return conn
 
 def is_read_only(conn):
     """
@@ -78,22 +321,411 @@ def is_read_only(conn):
         return True
     return False
 
-def get_db(readonly=False):
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+class PoolTimeout(Exception):
+    pass
+
+class NodePool:
     """
-    Get a fresh DB connection.
+    Bounded pool of connections to a single DB node.
 
-    - If readonly=True: allow connecting to any node (primary or replica).
-    - If readonly=False: ensure we connect to a writable node (pg_is_in_recovery() == false).
-    On failure, rotates current_db_index and tries other nodes (with small retry/backoff).
+    Connections are created on demand up to POOL_MAX_CONNECTIONS; checkout
+    blocks up to POOL_CHECKOUT_TIMEOUT when the pool is exhausted. Idle
+    connections above POOL_MIN_CONNECTIONS are closed after POOL_IDLE_TIMEOUT.
+    """
+
+    def __init__(self, index, minconn=POOL_MIN_CONNECTIONS, maxconn=POOL_MAX_CONNECTIONS):
+        self.index = index
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._idle = deque()  # (conn, last_used) pairs, most recently used on the right
+        self._size = 0  # open connections, idle + checked out
+        self._cond = threading.Condition()
+        self._last_reap = time.monotonic()
+
+    @property
+    def in_use(self):
+        with self._cond:
+            return self._size - len(self._idle)
+
+    def checkout(self, timeout=POOL_CHECKOUT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"Timed out waiting for a connection to DB{self.index+1}")
+                self._cond.wait(remaining)
+
+        if conn is None:
+            try:
+                return _connect_to_node(self.index)
+            except Exception:
+                self._discard(None)
+                raise
+
+        # Idle connections may point at a node that went away; ping them first
+        if conn.closed or (time.monotonic() - last_used > POOL_VALIDATE_AFTER and not self._ping(conn)):
+            self._discard(conn)
+            return self.checkout(max(0, deadline - time.monotonic()))
+        return conn
+
+    def checkin(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        self.reap()
+
+    def reap(self, force=False):
+        """
+        Close idle connections above minconn that have not been used for POOL_IDLE_TIMEOUT.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_reap < POOL_IDLE_TIMEOUT / 10:
+            return
+        expired = []
+        with self._cond:
+            self._last_reap = now
+            # oldest connections sit on the left
+            while self._idle and self._size - len(expired) > self.minconn:
+                conn, last_used = self._idle[0]
+                if now - last_used < POOL_IDLE_TIMEOUT:
+                    break
+                self._idle.popleft()
+                expired.append(conn)
+            self._size -= len(expired)
+        for conn in expired:
+            _close_quietly(conn)
+
+    def clear(self):
+        """
+        Close every idle connection, e.g. after the node failed or changed role.
+        """
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            _close_quietly(conn)
+
+    def _discard(self, conn):
+        if conn is not None:
+            _close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+_pools = [NodePool(i) for i in range(len(DB_CONFIGS))]
+
+# -------- DB topology monitor --------
+# Immutable snapshot of one probe of one node. lsn is the current WAL position
+# on a primary and the replay position on a replica, as an integer.
+NodeState = namedtuple('NodeState', 'index host reachable read_only lsn lag error')
+# Role map published by the monitor; primary is a node index or None.
+Topology = namedtuple('Topology', 'nodes primary probed_at')
+
+PROBE_QUERY = """
+    SELECT pg_is_in_recovery(),
+           CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+                ELSE pg_current_wal_lsn() END::text,
+           CASE WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END
+"""
+
+def parse_lsn(text):
+    """
+    Convert a textual LSN such as '0/3000148' into a comparable integer.
+    """
+    if not text:
+        return None
+    hi, lo = text.split('/')
+    return (int(hi, 16) << 32) | int(lo, 16)
+
+class TopologyMonitor(threading.Thread):
+    """
+    Probes every DB_CONFIGS node each TOPOLOGY_PROBE_INTERVAL and publishes
+    a Topology snapshot. Requests read the latest snapshot to pick a node
+    without any probing round trips of their own.
+
+    Nodes are probed in parallel over connections with PROBE_TIMEOUT
+    keepalive/statement limits, so a dead or hung node costs one
+    PROBE_TIMEOUT, not the sum of all nodes' timeouts.
+    """
+
+    def __init__(self):
+        super().__init__(name='db-topology-monitor', daemon=True)
+        self.topology = None
+        self._probe_conns = {}
+        self._wakeup = threading.Event()
+        self._prober = ThreadPoolExecutor(max_workers=len(DB_CONFIGS), thread_name_prefix='db-probe')
+
+    def run(self):
+        while True:
+            self._wakeup.wait(TOPOLOGY_PROBE_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.probe()
+            except Exception as e:
+                log(f"✗ Topology probe failed: {e}")
+            for pool in _pools:
+                pool.reap()
+
+    def wake(self):
+        """
+        Ask for an immediate re-probe, e.g. after a request hit a dead node.
+        """
+        self._wakeup.set()
+
+    def probe(self):
+        states = tuple(self._prober.map(self._probe_node, range(len(DB_CONFIGS))))
+        primary = next((st.index for st in states if st.reachable and not st.read_only), None)
+        self._publish(Topology(states, primary, time.monotonic()))
+
+    def _probe_node(self, idx):
+        host = DB_CONFIGS[idx]['host']
+        conn = self._probe_conns.get(idx)
+        try:
+            if conn is None or conn.closed:
+                conn = _connect_to_node(idx, **PROBE_CONNECT_OPTIONS)
+                conn.autocommit = True
+                self._probe_conns[idx] = conn
+            with conn.cursor() as cur:
+                cur.execute(PROBE_QUERY)
+                in_recovery, lsn, lag = cur.fetchone()
+            return NodeState(idx, host, True, bool(in_recovery), parse_lsn(lsn), float(lag), None)
+        except Exception as e:
+            if conn is not None:
+                _close_quietly(conn)
+            self._probe_conns.pop(idx, None)
+            return NodeState(idx, host, False, None, None, None, str(e).strip())
+
+    def _publish(self, topology):
+        previous = self.topology
+        for st in topology.nodes:
+            before = previous.nodes[st.index] if previous else None
+            if before is not None and (before.reachable, before.read_only) == (st.reachable, st.read_only):
+                continue
+            if not st.reachable:
+                log(f"✗ DB{st.index+1} ({st.host}) unreachable: {st.error}")
+                _pools[st.index].clear()
+            else:
+                log(f"✓ DB{st.index+1} ({st.host}) is {'replica' if st.read_only else 'primary'}")
+                if before is not None and before.reachable:
+                    # role changed (promotion/demotion): drop sessions opened under the old role
+                    _pools[st.index].clear()
+        self.topology = topology
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+def start_topology_monitor():
+    """
+    Start the background monitor once per process, after a first synchronous probe.
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None or not _monitor.is_alive():
+            monitor = TopologyMonitor()
+            monitor.probe()
+            monitor.start()
+            _monitor = monitor
+    return _monitor
+
+def current_topology():
+    """
+    Latest role map, or None when it is missing or too old to trust.
+    """
+    topology = start_topology_monitor().topology
+    if topology is None or time.monotonic() - topology.probed_at > TOPOLOGY_STALE_AFTER:
+        return None
+    return topology
+
+# -------- Read routing --------
+_rr_lock = threading.Lock()
+_rr_current = [0] * len(DB_CONFIGS)
+
+def _weight(idx):
+    return DB_CONFIGS[idx].get('weight', 1)
+
+def _pick_round_robin(indexes):
+    """
+    Smooth weighted round-robin: every node gets its weight added each pick
+    and the winner pays back the total, so picks interleave by weight.
+    """
+    total = sum(_weight(i) for i in indexes)
+    with _rr_lock:
+        for i in indexes:
+            _rr_current[i] += _weight(i)
+        best = max(indexes, key=lambda i: _rr_current[i])
+        _rr_current[best] -= total
+    return best
+
+def _pick_least_outstanding(indexes):
+    return min(indexes, key=lambda i: (_pools[i].in_use + 1) / max(_weight(i), 1e-9))
+
+def _read_order(topology):
+    """
+    Reachable nodes for a read, the routed choice first.
+
+    Replicas lagging more than MAX_REPLICA_LAG are left out of balancing but
+    kept at the end of the list as a last resort when nothing else answers.
+    """
+    reachable = [st for st in topology.nodes if st.reachable]
+    fallback = ([] if topology.primary is None else [topology.primary]) + \
+        [st.index for st in reachable if st.index != topology.primary]
+    if READ_ROUTING == 'primary':
+        return fallback
+    eligible = [st.index for st in reachable
+                if not st.read_only or (st.lag is not None and st.lag <= MAX_REPLICA_LAG)]
+    eligible = [i for i in eligible if _weight(i) > 0]
+    if not eligible:
+        return fallback
+    if READ_ROUTING == 'least_outstanding':
+        chosen = _pick_least_outstanding(eligible)
+    else:
+        chosen = _pick_round_robin(eligible)
+    return [chosen] + [i for i in fallback if i != chosen]
+
+def _caught_up_first(order, topology, min_lsn):
+    """
+    Move nodes that have not replayed up to min_lsn behind those that have.
+
+    The primary always qualifies. Nodes that are behind stay at the end only
+    as a last resort, so reads keep working if the primary is down.
+    """
+    def caught_up(idx):
+        st = topology.nodes[idx]
+        return idx == topology.primary or (st.lsn is not None and st.lsn >= min_lsn)
+    return [i for i in order if caught_up(i)] + [i for i in order if not caught_up(i)]
+
+def _candidate_nodes(readonly, min_lsn=None):
     """
-    global current_db_index
+    Node indexes to try, in order, and whether they still need a role check.
 
-    # try up to len(DB_CONFIGS) nodes, starting from current_db_index
-    nodes_count = len(DB_CONFIGS)
-    start_index = current_db_index
+    With a fresh role map, writes go straight to the primary and reads are
+    spread according to READ_ROUTING (restricted to nodes past min_lsn when
+    a consistency token was given). Without one we fall back to trying
+    every node in DB_CONFIGS order and probing pg_is_in_recovery() ourselves.
+    """
+    topology = current_topology()
+    if topology is None:
+        return list(range(len(DB_CONFIGS))), True
+    if readonly:
+        order = _read_order(topology)
+        if min_lsn is not None:
+            order = _caught_up_first(order, topology, min_lsn)
+        return order, False
+    return ([] if topology.primary is None else [topology.primary]), False
+
+def _checkout(readonly, min_lsn=None):
+    """
+    Check out a pooled connection, failing over between nodes.
+
+    - If readonly=True: any reachable node (primary or replica) will do,
+      preferring nodes that have replayed past min_lsn when it is given.
+    - If readonly=False: only a writable node (pg_is_in_recovery() == false).
+    Returns (pool, conn).
+    """
+    candidates, needs_role_check = _candidate_nodes(readonly, min_lsn)
+
+    for idx in candidates:
+        pool = _pools[idx]
+        cfg = DB_CONFIGS[idx]
+        try:
+            conn = pool.checkout()
+        except Exception as e:
+            log(f"✗ Cannot connect to DB{idx+1} ({cfg['host']}): {e}")
+            if _monitor is not None:
+                _monitor.wake()
+            continue
+
+        if needs_role_check and not readonly and is_read_only(conn):
+            log(f"✗ Connected to DB{idx+1} ({cfg['host']}) but it's read-only — skipping")
+            pool.checkin(conn)
+            continue
+
+        return pool, conn
+
+    raise Exception("All database connection attempts failed or no writable node available")
 
-    for attempt in range(nodes_count):
-        idx = (start_index + attempt) % nodes_count
+@contextmanager
+def db_connection(readonly=False, min_lsn=None):
+    """
+    Borrow a pooled connection for the duration of a with-block.
+
+    Pass min_lsn (see request_min_lsn()) to read your own writes. The
+    connection goes back to its pool afterwards (any open transaction is
+    rolled back, so commit explicitly or use `with conn:`). Errors that
+    leave the connection closed discard it, flush the node's idle
+    connections and trigger an immediate topology re-probe.
+    """
+    pool, conn = _checkout(readonly, min_lsn)
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        if not conn.closed:
+            # a failed query (deadlock, serialization failure, statement
+            # timeout) on a connection that is still fine
+            pool.checkin(conn)
+            raise
+        pool.checkin(conn, discard=True)
+        pool.clear()
+        if _monitor is not None:
+            _monitor.wake()
+        raise
+    except BaseException:
+        pool.checkin(conn)
+        raise
+    else:
+        pool.checkin(conn)
+
+def get_db(readonly=False, min_lsn=None):
+    """
+    Get a fresh, unpooled DB connection (caller must close it).
+
+    Meant for one-off or long-lived work such as schema setup and streamed
+    exports; request handlers should use db_connection() instead.
+    - If readonly=True: allow connecting to any node (primary or replica),
+      preferring nodes that have replayed past min_lsn when it is given.
+    - If readonly=False: ensure we connect to a writable node (pg_is_in_recovery() == false).
+    """
+    candidates, needs_role_check = _candidate_nodes(readonly, min_lsn)
+
+    for idx in candidates:
         cfg = DB_CONFIGS[idx]
         try:
             conn = _connect_to_node(idx)
@@ -101,32 +733,56 @@ def get_db(readonly=False):
             log(f"✗ Cannot connect to DB{idx+1} ({cfg['host']}): {e}")
             continue
 
-        # If caller needs writable, check server state
-        if not readonly:
-            try:
-                if is_read_only(conn):
-                    log(f"✗ Connected to DB{idx+1} ({cfg['host']}) but it's read-only — skipping")
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
-                    continue
-            except Exception as e:
-                log(f"✗ Error checking read-only on DB{idx+1} ({cfg['host']}): {e}")
-                try:
-                    conn.close()
-                except Exception:
-                    pass
-                continue
+        if needs_role_check and not readonly and is_read_only(conn):
+            log(f"✗ Connected to DB{idx+1} ({cfg['host']}) but it's read-only — skipping")
+            _close_quietly(conn)
+            continue
 
-        # success: update current_db_index to this node so subsequent calls prefer it
-        current_db_index = idx
         log(f"✓ Connected to DB{idx+1} ({cfg['host']}) {'(read-only allowed)' if readonly else '(writable)'}")
         return conn
 
     # If we reach here, no suitable node found
     raise Exception("All database connection attempts failed or no writable node available")
 
+# -------- Read-your-writes consistency tokens --------
+def current_wal_lsn(conn):
+    """
+    WAL position of a primary connection; call after committing a write.
+    """
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_current_wal_lsn()::text')
+        return cur.fetchone()[0]
+
+def request_min_lsn():
+    """
+    LSN the client must observe, from the token header or cookie (or None).
+    """
+    tokens = [request.headers.get(CONSISTENCY_HEADER), request.cookies.get(CONSISTENCY_COOKIE)]
+    lsns = []
+    for token in tokens:
+        try:
+            lsns.append(parse_lsn(token))
+        except ValueError:
+            continue
+    return later_lsn(*lsns)
+
+def later_lsn(*lsns):
+    """
+    The most recent of several LSNs, ignoring None.
+    """
+    known = [lsn for lsn in lsns if lsn is not None]
+    return max(known) if known else None
+
+def with_consistency_token(response, lsn):
+    """
+    Attach a write's LSN to the response as both a header and a cookie.
+    """
+    response.headers[CONSISTENCY_HEADER] = lsn
+    previous = request_min_lsn()
+    if previous is None or parse_lsn(lsn) >= previous:
+        response.set_cookie(CONSISTENCY_COOKIE, lsn, max_age=CONSISTENCY_TOKEN_TTL, httponly=True, samesite='Lax')
+    return response
+
 # -------- DB initialization --------
 def init_db():
     try:
@@ -143,6 +799,102 @@ def init_db():
                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                         )
                     ''')
+                    # pending until the worker has processed the image, then done or failed
+                    cur.execute('''
+                        ALTER TABLE content
+                        ADD COLUMN IF NOT EXISTS processing_state TEXT NOT NULL DEFAULT 'done'
+                    ''')
+                    # keyset pagination walks (created_at, id) newest first
+                    cur.execute('''
+                        CREATE INDEX IF NOT EXISTS content_created_at_id_idx
+                        ON content (created_at DESC, id DESC)
+                    ''')
+                    # reconcile.py pages through the filenames in byte order
+                    cur.execute('''
+                        CREATE INDEX IF NOT EXISTS content_image_filename_c_idx
+                        ON content (image_filename COLLATE "C")
+                    ''')
+                    # every statement touching content bumps the version and
+                    # notifies listening app nodes so they drop cached listings
+                    cur.execute('''
+                        CREATE TABLE IF NOT EXISTS images (
+                            filename TEXT PRIMARY KEY,
+                            ref_count INTEGER NOT NULL,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
+                    # generated variants: {"thumb": ["jpg", "webp", ...], ...}
+                    cur.execute('ALTER TABLE images ADD COLUMN IF NOT EXISTS variants JSONB')
+                    # filled in by the process_image job; placeholder is a data: URI
+                    cur.execute('''
+                        ALTER TABLE images
+                        ADD COLUMN IF NOT EXISTS width INTEGER,
+                        ADD COLUMN IF NOT EXISTS height INTEGER,
+                        ADD COLUMN IF NOT EXISTS byte_size BIGINT,
+                        ADD COLUMN IF NOT EXISTS dominant_color TEXT,
+                        ADD COLUMN IF NOT EXISTS placeholder TEXT
+                    ''')
+                    # resumable upload sessions; received counts contiguous bytes from 0
+                    cur.execute('''
+                        CREATE TABLE IF NOT EXISTS uploads (
+                            id UUID PRIMARY KEY,
+                            original_name TEXT NOT NULL,
+                            size BIGINT NOT NULL,
+                            received BIGINT NOT NULL DEFAULT 0,
+                            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                        )
+                    ''')
+                    # post-upload work, claimed by worker.py with FOR UPDATE SKIP LOCKED
+                    cur.execute('''
+                        CREATE TABLE IF NOT EXISTS jobs (
+                            id BIGSERIAL PRIMARY KEY,
+                            kind TEXT NOT NULL,
+                            payload JSONB NOT NULL,
+                            state TEXT NOT NULL DEFAULT 'queued',
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+                            locked_at TIMESTAMPTZ,
+                            last_error TEXT,
+                            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                        )
+                    ''')
+                    cur.execute('''
+                        CREATE INDEX IF NOT EXISTS jobs_runnable_idx
+                        ON jobs (run_after, id) WHERE state IN ('queued', 'running')
+                    ''')
+                    cur.execute('''
+                        CREATE TABLE IF NOT EXISTS content_version (
+                            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                            version BIGINT NOT NULL,
+                            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
+                    cur.execute('INSERT INTO content_version (version) VALUES (1) ON CONFLICT DO NOTHING')
+                    cur.execute(f'''
+                        CREATE OR REPLACE FUNCTION content_changed() RETURNS trigger AS $$
+                        DECLARE
+                            new_version BIGINT;
+                        BEGIN
+                            UPDATE content_version
+                               SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                            RETURNING version INTO new_version;
+                            PERFORM pg_notify('{CONTENT_CHANNEL}', new_version::text);
+                            RETURN NULL;
+                        END
+                        $$ LANGUAGE plpgsql
+                    ''')
+                    cur.execute('''
+                        CREATE OR REPLACE TRIGGER content_changed
+                        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON content
+                        FOR EACH STATEMENT EXECUTE FUNCTION content_changed()
+                    ''')
+                    # listings expose images.variants, so those updates count too
+                    cur.execute('''
+                        CREATE OR REPLACE TRIGGER images_changed
+                        AFTER UPDATE ON images
+                        FOR EACH STATEMENT EXECUTE FUNCTION content_changed()
+                    ''')
             log("✓ Database initialized (table ensured)")
         finally:
             try:
@@ -152,166 +904,2044 @@ def init_db():
     except Exception as e:
         log(f"✗ Database initialization failed: {e}")
 
-# -------- Upload folder handling --------
-def ensure_upload_folder():
-    if not os.path.exists(UPLOAD_FOLDER):
-        try:
-            os.makedirs(UPLOAD_FOLDER, mode=0o755, exist_ok=True)
-            log(f"✓ Created upload folder: {UPLOAD_FOLDER}")
-        except Exception as e:
-            log(f"✗ Failed to create upload folder: {e}")
-            # Fallback to local folder if NFS not mounted
-            local = './uploads'
-            app.config['UPLOAD_FOLDER'] = local
-            os.makedirs(local, exist_ok=True)
-            log(f"✓ Using local upload folder: {local}")
+# -------- Content listing queries --------
+ContentQuery = namedtuple('ContentQuery', 'fields limit after before')
 
-# -------- Flask routes --------
-@app.route('/')
-def welcome():
-    return render_template('welcome.html', hostname=hostname)
+def encode_cursor(row):
+    """
+    Opaque keyset cursor for a content row: its (created_at, id) position.
+    """
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
 
-@app.route('/admin')
-def admin():
-    return render_template('admin.html', hostname=hostname)
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, item_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(item_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
 
-@app.route('/images/<filename>')
-def serve_image(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+def parse_content_query(args):
+    """
+    Validate /api/content query parameters; raises ValueError on bad input.
 
-@app.route('/api/content', methods=['GET'])
-def get_content():
-    conn = None
-    try:
-        # For reads we allow replica
-        conn = get_db(readonly=True)
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute('SELECT id, quote, image_filename, created_at FROM content ORDER BY created_at DESC')
-            rows = cur.fetchall()
-        # Close connection
-        conn.close()
-        # Add image URL and return
-        for r in rows:
-            r['image_url'] = f"/images/{r['image_filename']}"
-        return jsonify(rows)
-    except Exception as e:
-        if conn:
-            try:
-                conn.close()
-            except Exception:
-                pass
-        return jsonify({'error': str(e)}), 500
+    No limit/after/before means the whole list (the original behaviour).
+    """
+    fields = CONTENT_FIELDS
+    if args.get('fields'):
+        fields = tuple(f.strip() for f in args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in CONTENT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
 
-@app.route('/api/content', methods=['POST'])
-def add_content():
-    conn = None
-    try:
-        # Basic validations
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
+    after = decode_cursor(args['after']) if args.get('after') else None
+    before = decode_cursor(args['before']) if args.get('before') else None
+    if after and before:
+        raise ValueError("Use either after or before, not both")
 
-        file = request.files['image']
-        quote = request.form.get('quote')
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    elif after or before:
+        limit = DEFAULT_PAGE_SIZE
 
-        if not quote:
-            return jsonify({'error': 'Quote is required'}), 400
+    return ContentQuery(fields, limit, after, before)
 
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+CONTENT_COLUMNS = {
+    'id': 'c.id',
+    'quote': 'c.quote',
+    'image_filename': 'c.image_filename',
+    'created_at': 'c.created_at',
+    'processing_state': 'c.processing_state',
+    'variants': 'i.variants',
+    'width': 'i.width',
+    'height': 'i.height',
+    'byte_size': 'i.byte_size',
+    'dominant_color': 'i.dominant_color',
+    'placeholder': 'i.placeholder'
+}
 
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file type. Only images allowed'}), 400
+def _content_sql(query, probe_next_page=True):
+    """
+    Build the SELECT for a ContentQuery; returns (sql, params).
+    """
+    columns = {'id', 'created_at'} | {f for f in query.fields if f != 'image_url'}
+    if 'image_url' in query.fields or 'variants' in query.fields:
+        columns.add('image_filename')
+    select = ', '.join(f'{expr} AS {name}' for name, expr in CONTENT_COLUMNS.items() if name in columns)
 
-        # Save file
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(unique_filename))
-        file.save(filepath)
+    sql = f'SELECT {select} FROM content c'
+    if any(CONTENT_COLUMNS[name].startswith('i.') for name in columns):
+        sql += ' LEFT JOIN images i ON i.filename = c.image_filename'
+    params = []
+    if query.after:
+        sql += ' WHERE (c.created_at, c.id) < (%s, %s)'
+        params += query.after
+    elif query.before:
+        sql += ' WHERE (c.created_at, c.id) > (%s, %s)'
+        params += query.before
+    # pages before a cursor are read oldest first from the cursor, then flipped
+    sql += ' ORDER BY c.created_at ASC, c.id ASC' if query.before else ' ORDER BY c.created_at DESC, c.id DESC'
+    if query.limit is not None:
+        # one extra row tells us whether another page exists
+        sql += ' LIMIT %s'
+        params.append(query.limit + 1 if probe_next_page else query.limit)
+    return sql, params
 
-        # Insert into DB (requires writable node)
-        conn = get_db(readonly=False)
+def _project_row(row, fields):
+    if 'image_url' in fields:
+        row['image_url'] = f"/images/{row['image_filename']}"
+    if 'variants' in fields:
+        row['variants'] = variant_urls(row['image_filename'], row['variants'])
+    for column in list(row):
+        if column not in fields:
+            del row[column]
+    return row
 
-        try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        'INSERT INTO content (quote, image_filename) VALUES (%s, %s) RETURNING id',
-                        (quote, unique_filename)
-                    )
-                    new_id = cur.fetchone()[0]
-            conn.close()
-        except Exception as db_exc:
-            # If insert failed, delete saved file to avoid orphan
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except Exception:
-                    pass
-            # Close conn if open
-            try:
-                conn.close()
-            except Exception:
-                pass
-            raise db_exc
+def fetch_content(conn, query):
+    """
+    Run a content listing query, newest first.
 
-        return jsonify({
-            'id': new_id,
-            'message': 'Content added successfully',
-            'image_url': f"/images/{unique_filename}"
-        }), 201
+    Returns (rows, next_cursor, prev_cursor); rows only carry the requested
+    fields and the cursors are None when there is no further page.
+    """
+    sql, params = _content_sql(query)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
 
-    except Exception as e:
-        # Return any error
-        return jsonify({'error': str(e)}), 500
+    has_more = query.limit is not None and len(rows) > query.limit
+    rows = rows[:query.limit] if query.limit is not None else rows
+    if query.before:
+        rows.reverse()
 
-@app.route('/api/content/<int:item_id>', methods=['DELETE'])
-def delete_content(item_id):
-    conn = None
-    try:
-        # Need writable DB to delete row
-        conn = get_db(readonly=False)
-        filename = None
-        try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute('SELECT image_filename FROM content WHERE id = %s', (item_id,))
-                    res = cur.fetchone()
-                    if res:
-                        filename = res[0]
-                        cur.execute('DELETE FROM content WHERE id = %s', (item_id,))
-            conn.close()
-        except Exception as inner_e:
-            try:
-                conn.close()
-            except Exception:
-                pass
-            raise inner_e
+    next_cursor = prev_cursor = None
+    if rows and query.limit is not None:
+        if query.before or has_more:
+            next_cursor = encode_cursor(rows[-1])
+        if query.after or (query.before and has_more):
+            prev_cursor = encode_cursor(rows[0])
 
-        # Delete file if exists
-        if filename:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except Exception as e:
-                    log(f"Warning: failed to remove file {filepath}: {e}")
+    for r in rows:
+        _project_row(r, query.fields)
+    return rows, next_cursor, prev_cursor
 
-        return jsonify({'message': 'Content deleted successfully'})
+def stream_content(query, min_lsn=None):
+    """
+    Yield the listing as NDJSON text chunks through a server-side cursor.
 
-    except Exception as e:
-        if conn:
-            try:
-                conn.close()
-            except Exception:
-                pass
-        return jsonify({'error': str(e)}), 500
+    The named cursor keeps only STREAM_ITERSIZE rows in memory at a time, so
+    memory use does not grow with the table. The query runs on the first
+    next() call, which lets the caller turn connection errors into a 500
+    before any bytes are sent.
 
-@app.route('/api/time')
-def get_time():
-    now = datetime.now()
-    return jsonify({
-        'time': now.strftime('%H:%M:%S'),
-        'date': now.strftime('%B %d, %Y'),
+    A slow client holds the connection until it has read everything, so
+    streams get their own unpooled connection: a few exports must not take
+    the pool away from normal requests.
+    """
+    sql, params = _content_sql(query, probe_next_page=False)
+    conn = get_db(readonly=True, min_lsn=min_lsn)
+    try:
+        with conn.cursor(name=f"content_stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cur:
+            cur.itersize = STREAM_ITERSIZE
+            cur.execute(sql, params)
+            yield ''
+            while True:
+                rows = cur.fetchmany(STREAM_ITERSIZE)
+                if not rows:
+                    break
+                yield ''.join(app.json.dumps(_project_row(r, query.fields)) + '\n' for r in rows)
+    finally:
+        _close_quietly(conn)
+
+def pagination_headers(query, next_cursor, prev_cursor):
+    """
+    Link / X-Next-Cursor / X-Prev-Cursor headers for a listing page.
+    """
+    headers = {}
+    links = []
+    base = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+    base['limit'] = query.limit
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+        links.append(f'<{url_for("get_content", after=next_cursor, **base)}>; rel="next"')
+    if prev_cursor:
+        headers['X-Prev-Cursor'] = prev_cursor
+        links.append(f'<{url_for("get_content", before=prev_cursor, **base)}>; rel="prev"')
+    if links:
+        headers['Link'] = ', '.join(links)
+    return headers
+
+# -------- Content validators (ETag / Last-Modified) --------
+def fetch_content_version(conn):
+    """
+    (version, updated_at) of the content table, shared by all app nodes.
+    """
+    with conn.cursor() as cur:
+        cur.execute('SELECT version, updated_at::timestamptz FROM content_version')
+        row = cur.fetchone()
+    return row if row else (0, None)
+
+def content_etag(version, query):
+    """
+    Strong validator for one listing: content version plus the query shape.
+    """
+    shape = hashlib.sha1(repr(tuple(query)).encode()).hexdigest()[:12]
+    return f"v{version}-{shape}"
+
+def is_not_modified(etag, last_modified):
+    """
+    Evaluate If-None-Match (preferred) or If-Modified-Since for this request.
+
+    Compressed variants carry the same validator plus an encoding suffix,
+    so any of them matches.
+    """
+    if request.if_none_match:
+        return any(request.if_none_match.contains_weak(tag)
+                   for tag in (etag, f"{etag}-gzip", f"{etag}-br"))
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def validator_headers(etag, last_modified):
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+# -------- Pre-serialized responses --------
+# A listing response held as ready-to-send bytes: bodies maps a content
+# coding ('identity', 'gzip', 'br') to its encoded body. preload is the
+# Link header value a rotation manifest offers the welcome page.
+Materialized = namedtuple('Materialized', 'bodies headers etag last_modified version preload',
+                          defaults=(None,))
+
+def materialize(body, headers, etag, last_modified, version, compress=True, preload=None):
+    """
+    Freeze a serialized listing, adding gzip/brotli variants when compress is set.
+    """
+    bodies = {'identity': body}
+    if compress and len(body) >= COMPRESS_MIN_SIZE:
+        bodies['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            bodies['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return Materialized(bodies, headers, etag, last_modified, version, preload)
+
+def materialized_size(entry):
+    return sum(len(body) for body in entry.bodies.values())
+
+def serve_materialized(entry):
+    """
+    Send the best variant the client accepts, or a 304, without re-encoding.
+    """
+    headers = dict(entry.headers)
+    if is_not_modified(entry.etag, entry.last_modified):
+        return Response(status=304, headers=headers)
+    encoding = request.accept_encodings.best_match([e for e in ('br', 'gzip') if e in entry.bodies])
+    if len(entry.bodies) > 1:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        headers['ETag'] = f'"{entry.etag}-{encoding}"'
+    body = entry.bodies[encoding or 'identity']
+    return Response(body, mimetype='application/json', headers=headers)
+
+# -------- Content listing cache --------
+class Flight:
+    """
+    One in-progress rebuild of a cache key. Waiters block on done and then
+    reuse entry (None if the rebuild produced nothing shareable).
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+class ContentCache:
+    """
+    LRU of Materialized /api/content responses keyed by ContentQuery, and
+    /api/rotation manifests keyed by RotationQuery.
+
+    invalidate() drops everything and bumps the generation; a fill that
+    started before an invalidation is not stored. min_lsn is the WAL position
+    of the latest known write, which refills must read at or past so a
+    lagging replica cannot repopulate the cache with old rows. The cache is
+    only used while the change listener is connected (see `available`).
+    Entries past their TTL are kept so the caller can revalidate them against
+    the content version and refresh() them instead of rebuilding. Rebuilds
+    are single-flight (join() / land()): after an invalidation, concurrent
+    misses on a key wait for one query instead of each running their own.
+    """
+
+    def __init__(self, ttl=CONTENT_CACHE_TTL, max_entries=CONTENT_CACHE_MAX_ENTRIES,
+                 max_bytes=CONTENT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self.min_lsn = None
+        self.available = False
+        self._entries = OrderedDict()  # key -> (Materialized, expires)
+        self._bytes = 0
+        self._flights = {}  # key -> Flight
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return (entry, fresh), or (None, False) on a miss.
+        """
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None, False
+            self._entries.move_to_end(key)
+            entry, expires = item
+            return entry, expires >= time.monotonic()
+
+    def fits(self, body_size):
+        """
+        Whether a body of body_size bytes can be cached, leaving room for its
+        compressed copies. Decide this before compressing.
+        """
+        return body_size <= self.max_bytes // 2
+
+    def join(self, key):
+        """
+        Returns (flight, leader). The leader rebuilds key and must call
+        land(); everybody else waits on flight.done.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def land(self, key, flight, entry):
+        flight.entry = entry
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.done.set()
+
+    def put(self, key, entry, generation):
+        size = materialized_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self.generation or not self.available:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (entry, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def refresh(self, key, generation):
+        """
+        Extend an entry's TTL after confirming its content version is current.
+        """
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and generation == self.generation:
+                self._entries[key] = (item[0], time.monotonic() + self.ttl)
+
+    def invalidate(self, min_lsn=None):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.generation += 1
+            if min_lsn is not None and (self.min_lsn is None or min_lsn > self.min_lsn):
+                self.min_lsn = min_lsn
+
+    def set_available(self, available):
+        with self._lock:
+            self.available = available
+        if not available:
+            self.invalidate()
+
+    def serves(self, request_lsn):
+        """
+        True if a request carrying request_lsn may be answered from the cache.
+        """
+        return self.available and (request_lsn is None or (self.min_lsn is not None and request_lsn <= self.min_lsn))
+
+    def _remove(self, key):
+        entry, _ = self._entries.pop(key)
+        self._bytes -= materialized_size(entry)
+
+content_cache = ContentCache()
+
+class ContentChangeListener(threading.Thread):
+    """
+    LISTENs on CONTENT_CHANNEL on the primary and invalidates content_cache
+    when any app node changes the content table. Also drops images deleted
+    on other nodes (IMAGE_CHANNEL) from the local image_cache.
+
+    NOTIFY is not available on standbys, so this follows the primary. While
+    disconnected the cache is switched off, since changes could be missed.
+    """
+
+    def __init__(self, cache):
+        super().__init__(name='content-change-listener', daemon=True)
+        self.cache = cache
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                conn = get_db(readonly=False)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {CONTENT_CHANNEL}')
+                    cur.execute(f'LISTEN {IMAGE_CHANNEL}')
+                # anything cached before we were listening may be stale
+                self.cache.invalidate(parse_lsn(current_wal_lsn(conn)))
+                self.cache.set_available(True)
+                log(f"✓ Listening for content changes on DB{conn.node_index+1}")
+                self._listen(conn)
+            except Exception as e:
+                log(f"✗ Content change listener error: {e}")
+            self.cache.set_available(False)
+            if conn is not None:
+                _close_quietly(conn)
+            time.sleep(LISTENER_RETRY_DELAY)
+
+    def _listen(self, conn):
+        while True:
+            if select.select([conn], [], [], TOPOLOGY_PROBE_INTERVAL) == ([], [], []):
+                # idle: make sure we are still talking to the primary
+                if is_read_only(conn):
+                    raise Exception("listener node is no longer the primary")
+                continue
+            conn.poll()
+            content_changed = False
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                if notify.channel == IMAGE_CHANNEL:
+                    image_cache.invalidate(notify.payload)
+                else:
+                    content_changed = True
+            if content_changed:
+                # the commit that sent the notification is at or before this LSN
+                self.cache.invalidate(parse_lsn(current_wal_lsn(conn)))
+
+_listener = None
+_listener_lock = threading.Lock()
+
+def start_content_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = ContentChangeListener(content_cache)
+            _listener.start()
+    return _listener
+
+# -------- Streaming uploads --------
+class UploadFile:
+    """
+    Destination for a multipart file part, written as the request streams in.
+
+    Werkzeug's parser writes the part straight into a temp file in the
+    storage's staging directory (on the final volume for file storage, not a
+    local spool), while the SHA-256 and size are updated on the fly and
+    MAX_FILE_SIZE is enforced per chunk. commit() hands the file to storage
+    (an atomic rename for file storage); a file that is never committed is
+    deleted when the request closes.
+    """
+
+    def __init__(self, max_size=MAX_FILE_SIZE):
+        incoming = storage.staging_dir()
+        os.makedirs(incoming, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=incoming, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.max_size = max_size
+        self.size = 0
+        self.committed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge(f"File exceeds {self.max_size // (1024 * 1024)}MB limit")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def stage(self):
+        """
+        Flush to disk and release the file handle; commit() then only renames.
+        """
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def commit(self, name):
+        """
+        Flush to disk and put the upload in storage as name.
+        """
+        self.stage()
+        storage.put(name, self.temp_path)
+        self.committed = True
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed:
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        # read/seek/tell/... for Werkzeug's FileStorage
+        return getattr(self._file, name)
+
+class UploadPartParser(MultiPartParser):
+    """
+    MultiPartParser that also tells the stream factory which field a file
+    part belongs to, so the size limit can depend on it.
+    """
+
+    def start_file_streaming(self, event, total_content_length):
+        try:
+            content_length = int(event.headers['content-length'])
+        except (KeyError, ValueError):
+            content_length = 0
+        return self.stream_factory(
+            total_content_length=total_content_length,
+            filename=event.filename,
+            content_type=event.headers.get('content-type'),
+            content_length=content_length,
+            field=event.name,
+        )
+
+class UploadFormParser(FormDataParser):
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        parser = UploadPartParser(
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+        )
+        boundary = options.get('boundary', '').encode('ascii')
+        if not boundary:
+            raise ValueError('Missing boundary')
+        form, files = parser.parse(stream, boundary, content_length)
+        return stream, form, files
+
+class UploadRequest(Request):
+    """
+    Request whose multipart file parts stream into UploadFile objects.
+    """
+
+    form_data_parser_class = UploadFormParser
+    max_file_size = MAX_FILE_SIZE  # per file part
+    max_file_sizes = {}  # per field name, overriding max_file_size; a view may set it before reading the form
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None,
+                         field=None):
+        stream = UploadFile(max_size=self.max_file_sizes.get(field, self.max_file_size))
+        # parts that fail half way never reach request.files; close them ourselves
+        self._upload_streams = getattr(self, '_upload_streams', []) + [stream]
+        return stream
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for stream in getattr(self, '_upload_streams', []):
+                stream.close()
+
+app.request_class = UploadRequest
+
+# -------- Resumable uploads --------
+def upload_part_path(upload_id):
+    return os.path.join(storage.staging_dir(), f"{upload_id}.upload")
+
+class AssembledUpload:
+    """
+    A completed resumable upload, in the file its chunks were written into.
+
+    Stands in for UploadFile in acquire_image(): the bytes are hashed with
+    one sequential read (chunks may arrive more than once, so they cannot be
+    hashed as they come) and handed to storage the same way, so file storage
+    renames it rather than copying. Each chunk was fsynced when it was
+    acknowledged. Call close() once the finalizing transaction has committed:
+    a duplicate of an existing image is never committed, and its file is
+    removed there.
+    """
+
+    def __init__(self, path):
+        self.temp_path = path
+        self._hash = hashlib.sha256()
+        self.size = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                self._hash.update(block)
+                self.size += len(block)
+        self.committed = False
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def commit(self, name):
+        storage.put(name, self.temp_path)
+        self.committed = True
+
+    def close(self):
+        if not self.committed:
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
+
+def write_chunk(upload_id, offset, size, stream):
+    """
+    Write a request body into the upload's file at offset.
+
+    Returns the end offset reached, which is also reported when the client
+    disconnects half way, so a retry only resends what never arrived.
+    """
+    fd = os.open(upload_part_path(upload_id), os.O_WRONLY)
+    position = offset
+    try:
+        for block in iter(lambda: stream.read(64 * 1024), b''):
+            if position + len(block) > size:
+                raise ValueError(f"Chunk extends past the declared size of {size} bytes")
+            os.pwrite(fd, block, position)
+            position += len(block)
+    finally:
+        os.fsync(fd)
+        os.close(fd)
+        if position > offset:
+            record_received(upload_id, offset, position)
+    return position
+
+def record_received(upload_id, offset, end):
+    """
+    Advance received to end if [offset, end) continues the contiguous prefix.
+    """
+    with db_connection(readonly=False) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    '''UPDATE uploads SET received = GREATEST(received, %s), updated_at = now()
+                       WHERE id = %s AND received >= %s
+                       RETURNING received''',
+                    (end, str(upload_id), offset)
+                )
+                res = cur.fetchone()
+    return res[0] if res else None
+
+def expire_upload_sessions(cur):
+    """
+    Drop sessions idle for UPLOAD_SESSION_TTL along with their partial files.
+    """
+    cur.execute(
+        'DELETE FROM uploads WHERE updated_at < now() - make_interval(secs => %s) RETURNING id',
+        (UPLOAD_SESSION_TTL,)
+    )
+    for (upload_id,) in cur.fetchall():
+        try:
+            os.remove(upload_part_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+# -------- Image store --------
+def make_storage(backend=STORAGE_BACKEND):
+    if backend == 's3':
+        return S3Storage(S3_BUCKET, prefix=S3_PREFIX, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION,
+                         access_key=S3_ACCESS_KEY, secret_key=S3_SECRET_KEY,
+                         **({'staging_dir': STORAGE_STAGING_DIR} if STORAGE_STAGING_DIR else {}))
+    driver = NFSStorage if backend == 'nfs' else LocalStorage
+    return driver(app.config['UPLOAD_FOLDER'], staging_dir=STORAGE_STAGING_DIR, incoming_dir=INCOMING_DIR,
+                  sharded=STORAGE_LAYOUT == 'sharded', flat_fallback=STORAGE_FLAT_FALLBACK)
+
+storage = make_storage()
+
+def upload_filename(upload, original_name):
+    """
+    Stored name for an upload: its SHA-256 in content-addressed mode, else a UUID.
+    """
+    ext = original_name.rsplit('.', 1)[1].lower()
+    if CONTENT_ADDRESSED_STORAGE:
+        ext = 'jpg' if ext == 'jpeg' else ext
+        return f"{upload.sha256}.{ext}"
+    return f"{uuid.uuid4()}.{ext}"
+
+def acquire_image(cur, upload, filename):
+    """
+    Add a reference to filename and make sure its bytes are in place.
+
+    Call inside the transaction that inserts the content row. The images row
+    stays locked until commit, so a concurrent release of the last reference
+    cannot orphan the file underneath us (see remove_image_files()). When the file already exists
+    (a duplicate upload) the temp copy is simply dropped.
+    Returns True if this call put the file in place.
+    """
+    cur.execute(
+        '''INSERT INTO images (filename, ref_count) VALUES (%s, 1)
+           ON CONFLICT (filename) DO UPDATE SET ref_count = images.ref_count + 1
+           RETURNING ref_count''',
+        (filename,)
+    )
+    if cur.fetchone()[0] == 1 or not storage.exists(filename):
+        upload.commit(filename)
+        return True
+    return False
+
+def acquire_images(cur, counts):
+    """
+    acquire_image() for a batch: add counts[filename] references to each file
+    with one statement. Returns the filenames whose bytes the caller must put
+    in place (new files, or rows whose file has gone missing) before the
+    transaction commits.
+    """
+    # sorted, so concurrent batches lock images rows in the same order
+    rows = execute_values(
+        cur,
+        '''INSERT INTO images (filename, ref_count) VALUES %s
+           ON CONFLICT (filename) DO UPDATE SET ref_count = images.ref_count + EXCLUDED.ref_count
+           RETURNING filename, ref_count''',
+        sorted(counts.items()), page_size=1000, fetch=True
+    )
+    return [filename for filename, ref_count in rows
+            if ref_count == counts[filename] or not storage.exists(filename)]
+
+def release_images(cur, counts):
+    """
+    Drop counts[filename] references per file inside the deleting transaction.
+
+    Files left without references lose their images row, and other app
+    nodes are told (IMAGE_CHANNEL) to drop their local copies once this
+    commits. Rows from before reference counting have no images row and
+    count as a single reference. Returns {filename: variants} for the
+    orphaned files; pass it to schedule_file_cleanup() after commit.
+    """
+    filenames = sorted(counts)
+    # lock in a fixed order so concurrent bulk deletes cannot deadlock
+    cur.execute('SELECT filename FROM images WHERE filename = ANY(%s) ORDER BY filename FOR UPDATE', (filenames,))
+    cur.execute(
+        '''UPDATE images SET ref_count = images.ref_count - d.n
+           FROM unnest(%s::text[], %s::int[]) AS d(filename, n)
+           WHERE images.filename = d.filename
+           RETURNING images.filename, images.ref_count, images.variants''',
+        (filenames, [counts[filename] for filename in filenames])
+    )
+    remaining = {filename: (ref_count, variants) for filename, ref_count, variants in cur.fetchall()}
+    orphans = {filename: remaining.get(filename, (0, None))[1]
+               for filename in filenames if remaining.get(filename, (0, None))[0] <= 0}
+    if orphans:
+        cur.execute('DELETE FROM images WHERE filename = ANY(%s)', (list(orphans),))
+        cur.execute('SELECT pg_notify(%s, f) FROM unnest(%s::text[]) AS f', (IMAGE_CHANNEL, list(orphans)))
+    return orphans
+
+def remove_image_files(orphans):
+    """
+    Unlink orphaned images ({filename: variants}) and their variants.
+
+    Runs after the deleting transaction committed, so an upload of the same
+    bytes may have brought a file back meanwhile. Each file is first claimed
+    with a placeholder images row (ref_count 0): an existing row means the
+    file is in use again and is left alone, and while the placeholder is
+    held a concurrent upload of that file waits for the unlink to finish.
+    """
+    with db_connection(readonly=False) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    '''INSERT INTO images (filename, ref_count) SELECT f, 0 FROM unnest(%s::text[]) AS f
+                       ON CONFLICT (filename) DO NOTHING
+                       RETURNING filename''',
+                    (sorted(orphans),)
+                )
+                claimed = [row[0] for row in cur.fetchall()]
+                for filename in claimed:
+                    for name in [filename] + variant_filenames(filename, orphans[filename]):
+                        try:
+                            storage.delete(name)
+                        except Exception as e:
+                            log(f"Warning: failed to remove image {name}: {e}")
+                    image_cache.invalidate(filename)
+                cur.execute('DELETE FROM images WHERE filename = ANY(%s) AND ref_count = 0', (claimed,))
+    return len(claimed)
+
+def _remove_image_files_logged(orphans):
+    try:
+        remove_image_files(orphans)
+    except Exception as e:
+        # left for the reconciliation job
+        log(f"✗ Failed to remove {len(orphans)} orphaned image files: {e}")
+
+_file_cleanup = ThreadPoolExecutor(max_workers=FILE_CLEANUP_WORKERS, thread_name_prefix='file-cleanup')
+
+def schedule_file_cleanup(orphans):
+    """
+    Unlink orphaned files in the background, FILE_CLEANUP_CHUNK per task.
+    """
+    filenames = sorted(orphans)
+    for start in range(0, len(filenames), FILE_CLEANUP_CHUNK):
+        chunk = {filename: orphans[filename] for filename in filenames[start:start + FILE_CLEANUP_CHUNK]}
+        _file_cleanup.submit(_remove_image_files_logged, chunk)
+
+# -------- Image variants --------
+PIL_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'avif': 'AVIF'}
+
+def variant_filename(filename, name, fmt):
+    # the whole original name, extension included: the same bytes stored as
+    # X.jpg and X.png must not share (and on delete, unlink) X.thumb.webp
+    return f"{filename}.{name}.{fmt}"
+
+def variant_filenames(filename, variants):
+    """
+    Stored names of every generated variant of filename.
+    """
+    return [variant_filename(filename, name, fmt) for name, formats in (variants or {}).items() for fmt in formats]
+
+def variant_urls(filename, variants):
+    """
+    Public URL per variant. Each URL names the variant in the original's
+    format; serve_image swaps in WebP/AVIF when the browser accepts them.
+    """
+    return {name: f"/images/{variant_filename(filename, name, formats[0])}"
+            for name, formats in (variants or {}).items()}
+
+def _encodable_formats(base):
+    formats = [base]
+    for fmt in VARIANT_FORMATS:
+        if fmt != base and features.check(fmt):
+            formats.append(fmt)
+    return formats
+
+def image_metadata(img):
+    """
+    Display width/height (after EXIF orientation), dominant color and a
+    PLACEHOLDER_SIZE px preview as a data: URI for an open image.
+
+    Works on a heavily downscaled copy; JPEGs are decoded at reduced scale
+    (draft mode), so this costs a fraction of a full decode.
+    """
+    width, height = img.size
+    if img.getexif().get(0x0112) in (5, 6, 7, 8):  # Orientation: rotated 90 degrees
+        width, height = height, width
+    img.draft('RGB', (64, 64))
+    small = ImageOps.exif_transpose(img)
+    small.thumbnail((64, 64))
+    small = small.convert('RGB')
+
+    quantized = small.quantize(colors=8)
+    _, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.LANCZOS)
+    fmt = 'webp' if features.check('webp') else 'jpeg'
+    buf = io.BytesIO()
+    small.save(buf, fmt.upper(), quality=40)
+    return {
+        'width': width,
+        'height': height,
+        'dominant_color': f'#{r:02x}{g:02x}{b:02x}',
+        'placeholder': f"data:image/{fmt};base64,{base64.b64encode(buf.getvalue()).decode('ascii')}"
+    }
+
+def generate_variants(filename, source):
+    """
+    Write resized variants of an uploaded image (read from the local file
+    source) to storage and record them in images.variants.
+
+    Variants never upscale: sizes at or above the original width are skipped
+    (the original serves those). EXIF orientation is applied and no metadata
+    is copied into the variants. Returns the variants mapping.
+    """
+    ext = filename.rsplit('.', 1)[1]
+    base = {'jpeg': 'jpg'}.get(ext, ext)
+    if Image is None or base not in PIL_FORMATS:
+        return {}
+
+    variants = {}
+    incoming = storage.staging_dir()
+    os.makedirs(incoming, exist_ok=True)
+    with Image.open(source) as original:
+        img = ImageOps.exif_transpose(original)
+        for name, width in IMAGE_VARIANTS.items():
+            if img.width <= width:
+                continue
+            resized = img.copy()
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+            formats = _encodable_formats(base)
+            for fmt in formats:
+                out = resized if fmt != 'jpg' or resized.mode == 'RGB' else resized.convert('RGB')
+                fd, tmp = tempfile.mkstemp(dir=incoming, suffix='.part')
+                with os.fdopen(fd, 'wb') as f:
+                    out.save(f, PIL_FORMATS[fmt], quality=VARIANT_QUALITY)
+                storage.put(variant_filename(filename, name, fmt), tmp)
+            variants[name] = formats
+
+    with db_connection(readonly=False) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute('UPDATE images SET variants = %s WHERE filename = %s', (Json(variants), filename))
+    return variants
+
+# -------- Job queue --------
+def enqueue_job(cur, kind, payload):
+    """
+    Queue a job in the caller's transaction; it becomes visible to workers
+    (and wakes them through JOB_CHANNEL) only when that transaction commits.
+    """
+    return enqueue_jobs(cur, kind, [payload])[0]
+
+def enqueue_jobs(cur, kind, payloads):
+    rows = execute_values(
+        cur, 'INSERT INTO jobs (kind, payload) VALUES %s RETURNING id',
+        [(kind, Json(payload)) for payload in payloads], page_size=1000, fetch=True
+    )
+    cur.execute('SELECT pg_notify(%s, %s)', (JOB_CHANNEL, kind))
+    return [row[0] for row in rows]
+
+def claim_job(cur):
+    """
+    Lease the oldest runnable job, or return None.
+
+    SKIP LOCKED lets any number of workers claim concurrently without
+    blocking on each other. A job still 'running' after JOB_LEASE seconds
+    belongs to a worker that died and is handed out again, unless it has
+    used up JOB_MAX_ATTEMPTS (see fail_expired_jobs()).
+    """
+    cur.execute('''
+        UPDATE jobs SET state = 'running', attempts = attempts + 1, locked_at = now()
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE (state = 'queued' AND run_after <= now())
+               OR (state = 'running' AND locked_at < now() - make_interval(secs => %s) AND attempts < %s)
+            ORDER BY run_after, id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, kind, payload, attempts
+    ''', (JOB_LEASE, JOB_MAX_ATTEMPTS))
+    return cur.fetchone()
+
+def fail_expired_jobs(cur):
+    """
+    Park expired leases that have used up JOB_MAX_ATTEMPTS as 'failed'.
+
+    A job that kills its worker (say, out of memory decoding a huge image)
+    never reaches fail_job(); without this it would be reclaimed every
+    JOB_LEASE seconds forever. Runs each job's finished hook with
+    failed=True. Returns the number of jobs failed.
+    """
+    cur.execute('''
+        UPDATE jobs SET state = 'failed', locked_at = NULL,
+                        last_error = 'lease expired: the worker died while running the job'
+        WHERE id IN (
+            SELECT id FROM jobs
+            WHERE state = 'running' AND locked_at < now() - make_interval(secs => %s) AND attempts >= %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, payload
+    ''', (JOB_LEASE, JOB_MAX_ATTEMPTS))
+    expired = cur.fetchall()
+    for job_id, kind, payload in expired:
+        log(f"✗ Job {job_id} ({kind}) failed: lease expired after {JOB_MAX_ATTEMPTS} attempts")
+        on_finished = JOB_HANDLERS.get(kind, (None, None))[1]
+        if on_finished is not None:
+            on_finished(cur, payload, failed=True)
+    return len(expired)
+
+def finish_job(cur, job_id):
+    cur.execute('DELETE FROM jobs WHERE id = %s', (job_id,))
+
+def fail_job(cur, job_id, attempts, error):
+    """
+    Retry with a linear backoff, or park the job as 'failed' after JOB_MAX_ATTEMPTS.
+    Returns True when the job will not be retried.
+    """
+    final = attempts >= JOB_MAX_ATTEMPTS
+    cur.execute(
+        '''UPDATE jobs SET state = %s, locked_at = NULL, last_error = %s,
+                  run_after = now() + make_interval(secs => %s)
+           WHERE id = %s''',
+        ('failed' if final else 'queued', error, JOB_RETRY_DELAY * attempts, job_id)
+    )
+    return final
+
+def process_image(payload):
+    """
+    'process_image' job: validate the stored original, record its size,
+    dimensions, dominant color and placeholder, and generate its variants.
+    """
+    filename = payload['filename']
+    with storage.local_copy(filename) as source:
+        metadata = {'byte_size': os.path.getsize(source)}
+        if Image is not None:
+            with Image.open(source) as img:
+                img.verify()  # raises on truncated or non-image uploads
+            with Image.open(source) as img:
+                metadata.update(image_metadata(img))
+        variants = generate_variants(filename, source)
+    with db_connection(readonly=False) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                columns = sorted(metadata)
+                cur.execute(
+                    f"UPDATE images SET {', '.join(f'{c} = %s' for c in columns)} WHERE filename = %s",
+                    [metadata[c] for c in columns] + [filename]
+                )
+    log(f"✓ Generated {sum(len(f) for f in variants.values())} variants for {filename}")
+
+def process_image_done(cur, payload, failed=False):
+    cur.execute(
+        'UPDATE content SET processing_state = %s WHERE image_filename = %s',
+        ('failed' if failed else 'done', payload['filename'])
+    )
+
+# kind -> (handler run outside any transaction, hook run in the transaction
+# that finishes the job: hook(cur, payload, failed=False))
+JOB_HANDLERS = {
+    'process_image': (process_image, process_image_done)
+}
+
+class ImageDiskCache:
+    """
+    Read-through copy of image storage on local disk, LRU-evicted by size.
+
+    The first request for an image copies it from storage; later requests are
+    served from local disk (and the local page cache).
+
+    Every worker process of the WSGI server shares the directory, so the
+    in-memory index is only this process's view of it. It is rebuilt from
+    the directory (oldest mtime first) on first use, whenever this process
+    counts more than max_bytes, and on a miss every LOCAL_IMAGE_CACHE_RESCAN
+    seconds, so max_bytes caps the directory as a whole rather than each
+    process. Hits bump a file's mtime (at most once per rescan period) to
+    share recency between processes.
+    """
+
+    def __init__(self, directory, max_bytes=LOCAL_IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index = None  # filename -> (size, last touched), least recently used first
+        self._bytes = 0
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name, st.st_size))
+        self._index = OrderedDict((name, (size, 0)) for _, name, size in sorted(entries))
+        self._bytes = sum(size for size, _ in self._index.values())
+        self._loaded_at = time.monotonic()
+
+    def fetch(self, filename):
+        """
+        Local path of filename, copying it from the upload folder on a miss.
+        Returns None if the image does not exist.
+        """
+        local = safe_join(self.directory, filename)
+        if local is None:
+            return None
+        with self._lock:
+            if self._index is None:
+                self._load()
+            if filename in self._index:
+                size, touched = self._index[filename]
+                now = time.monotonic()
+                try:
+                    if now - touched > LOCAL_IMAGE_CACHE_RESCAN:
+                        os.utime(local)  # other processes evict by mtime
+                        touched = now
+                    elif not os.path.exists(local):
+                        raise FileNotFoundError(local)
+                    self._index[filename] = (size, touched)
+                    self._index.move_to_end(filename)
+                    return local
+                except FileNotFoundError:
+                    # evicted by another process
+                    self._bytes -= self._index.pop(filename)[0]
+
+        try:
+            chunks = storage.stream(filename)
+        except FileNotFoundError:
+            return None
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.fetch-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+            os.replace(tmp, local)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+        size = os.path.getsize(local)
+        evicted = []
+        with self._lock:
+            if filename not in self._index:
+                self._index[filename] = (size, time.monotonic())
+                self._bytes += size
+            if self._bytes > self.max_bytes or time.monotonic() - self._loaded_at > LOCAL_IMAGE_CACHE_RESCAN:
+                # count what every process has put in the directory, not just our files
+                self._load()
+                if filename in self._index:
+                    self._index.move_to_end(filename)
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                name, (old_size, _) = self._index.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append(name)
+        for name in evicted:
+            self._unlink(name)
+        return local
+
+    def invalidate(self, filename):
+        """
+        Drop filename and any cached variants of it (<filename>.<variant>.<fmt>).
+        """
+        prefix = filename + '.'
+        with self._lock:
+            if self._index is None:
+                names = [filename]
+            else:
+                names = [name for name in self._index if name == filename or name.startswith(prefix)]
+                for name in names:
+                    self._bytes -= self._index.pop(name)[0]
+        for name in names:
+            self._unlink(name)
+
+    def _unlink(self, filename):
+        path = safe_join(self.directory, filename)
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log(f"Warning: failed to evict cached image {path}: {e}")
+
+class NullImageCache:
+    """
+    Stand-in when LOCAL_IMAGE_CACHE_DIR is None: always read from storage.
+    """
+
+    def fetch(self, filename):
+        return None
+
+    def invalidate(self, filename):
+        pass
+
+image_cache = ImageDiskCache(LOCAL_IMAGE_CACHE_DIR) if LOCAL_IMAGE_CACHE_DIR else NullImageCache()
+
+# -------- Welcome page rotation --------
+def rotation_item(row):
+    """
+    Add srcset/sizes to a projected ROTATION_FIELDS row, so the browser
+    picks the candidate that covers the screen (background-size: cover)
+    when it preloads the image.
+    """
+    # without the original's width (not processed yet) only image_url is safe
+    candidates = []
+    if row['width']:
+        candidates = sorted((IMAGE_VARIANTS[name], url) for name, url in row['variants'].items()
+                            if name in IMAGE_VARIANTS and IMAGE_VARIANTS[name] < row['width'])
+        candidates.append((row['width'], row['image_url']))
+    row['srcset'] = ', '.join(f"{url} {width}w" for width, url in candidates)
+    if row['width'] and row['height']:
+        # a tall image is stretched to the screen height
+        row['sizes'] = f"max(100vw, {100 * row['width'] / row['height']:.2f}vh)"
+    else:
+        row['sizes'] = '100vw'
+    return row
+
+RotationQuery = namedtuple('RotationQuery', 'after count')
+
+def rotation_manifest(conn, after, count):
+    """
+    The next count items of the rotation (newest first, wrapping around to
+    the newest again) after cursor position after. Returns the /api/rotation
+    body; its 'next' cursor is None when the following manifest starts over.
+    """
+    rows, next_cursor, _ = fetch_content(conn, ContentQuery(ROTATION_FIELDS, count, after, None))
+    if next_cursor is None and after is not None:
+        more, next_cursor, _ = fetch_content(conn, ContentQuery(ROTATION_FIELDS, count - len(rows), None, None))
+        rows += more
+    return {
+        'items': [rotation_item(row) for row in rows],
+        'next': next_cursor,
+        'interval': ROTATION_INTERVAL
+    }
+
+def preload_link(item):
+    link = f'<{item["image_url"]}>; rel=preload; as=image'
+    if item['srcset']:
+        link += f'; imagesrcset="{item["srcset"]}"; imagesizes="{item["sizes"]}"'
+    return link
+
+def build_rotation(conn, query):
+    """
+    serve_cached() builder for /api/rotation; the preload hints for its
+    first ROTATION_PRELOAD items are kept with the cached manifest.
+    """
+    manifest = rotation_manifest(conn, query.after, query.count)
+    preload = ', '.join(preload_link(item) for item in manifest['items'][:ROTATION_PRELOAD])
+    return manifest, {}, preload or None
+
+# -------- Storage check --------
+def ensure_storage():
+    global storage
+    try:
+        storage.check()
+        log(f"✓ Image storage ready ({storage.name})")
+    except Exception as e:
+        log(f"✗ Image storage unavailable ({storage.name}): {e}")
+        if storage.name == 's3':
+            return
+        # Fallback to local folder if NFS not mounted
+        local = './uploads'
+        app.config['UPLOAD_FOLDER'] = local
+        storage = make_storage('local')
+        storage.check()
+        log(f"✓ Using local upload folder: {local}")
+
+# -------- Flask routes --------
+@app.route('/')
+def welcome():
+    response = app.make_response(render_template('welcome.html', hostname=hostname))
+    # let the browser fetch the first backgrounds while it parses the page;
+    # hints only come from the cached first manifest, the page never waits on the DB
+    entry, _ = content_cache.get(RotationQuery(None, ROTATION_MANIFEST_SIZE))
+    if entry is not None and entry.preload:
+        response.headers['Link'] = entry.preload
+    return response
+
+@app.route('/admin')
+def admin():
+    return render_template('admin.html', hostname=hostname,
+                           max_file_size=MAX_FILE_SIZE, resumable_max_file_size=RESUMABLE_MAX_FILE_SIZE)
+
+def image_etag(name):
+    # originals: the stem (UUID or hash); variants: the whole name, which includes the format
+    return name if name.count('.') > 1 else name.rsplit('.', 1)[0]
+
+def negotiate_image(filename):
+    """
+    Stored names that may answer a request for filename, best first.
+
+    A variant URL (<original>.<variant>.<fmt>) prefers AVIF, then WebP, when
+    the browser lists them in Accept; originals are served as they are.
+    """
+    parts = filename.rsplit('.', 2)
+    if len(parts) != 3 or parts[1] not in IMAGE_VARIANTS or '.' not in parts[0]:
+        return [filename]
+    original, variant, ext = parts
+    accepted = set(request.accept_mimetypes.values())
+    preferred = [fmt for fmt in ('avif', 'webp')
+                 if fmt in VARIANT_FORMATS and fmt != ext and f'image/{fmt}' in accepted]
+    return [variant_filename(original, variant, fmt) for fmt in preferred] + [filename]
+
+class MissingVariants:
+    """
+    Negotiated variant names recently found missing in storage.
+
+    Without it a browser that accepts AVIF would cost a storage lookup on
+    every request for a variant that only exists as WebP. Entries expire
+    after ttl, since reconcile.py may regenerate a variant in the meantime.
+    """
+
+    def __init__(self, ttl=MISSING_VARIANT_TTL, max_entries=MISSING_VARIANT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # name -> expires, oldest first
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        with self._lock:
+            expires = self._entries.get(name)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._entries[name]
+                return False
+            return True
+
+    def add(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
+            self._entries[name] = time.monotonic() + self.ttl
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+missing_variants = MissingVariants()
+
+def locate_image(name, must_exist=True):
+    """
+    (local path, X-Accel-Redirect URI) for name, preferring the local disk
+    cache. Both are None for an image that only an object store holds.
+
+    With must_exist, returns None unless the image is actually there;
+    otherwise a missing image 404s when it is sent.
+    """
+    # redirects to presigned URLs keep image bytes off the app VMs entirely
+    if IMAGE_DELIVERY != 'redirect':
+        try:
+            local = image_cache.fetch(name)
+            if local:
+                return local, X_ACCEL_CACHE_PREFIX + name
+        except Exception as e:
+            log(f"✗ Local image cache unavailable, reading from storage: {e}")
+    try:
+        path = storage.path(name)
+    except FileNotFoundError:
+        return None  # not a valid stored name
+    if must_exist and not (os.path.isfile(path) if path else storage.exists(name)):
+        return None
+    if path is None:
+        return None, None
+    return path, X_ACCEL_UPLOAD_PREFIX + storage.key(name)
+
+@app.route('/images/<filename>')
+def serve_image(filename):
+    """
+    Serve an uploaded image (or one of its variants) with immutable caching,
+    from the local disk cache when possible.
+
+    Stored names (UUIDs or content hashes) always map to the same bytes, so
+    the name itself is a strong ETag and a matching If-None-Match is
+    answered with 304 before touching storage. If-Modified-Since carries no
+    name, so it gets a 304 only once the image is found. Range and If-Range
+    requests are handled by send_file against the same ETag. For file
+    storage the bytes never pass through Python: see IMAGE_DELIVERY.
+    """
+    candidates = negotiate_image(filename)
+    headers = {'Cache-Control': f'public, max-age={IMAGE_CACHE_MAX_AGE}, immutable'}
+    if len(candidates) > 1:
+        headers['Vary'] = 'Accept'
+
+    # any format of the same variant is a valid cached copy
+    for name in candidates:
+        if request.if_none_match.contains(image_etag(name)):
+            headers['ETag'] = f'"{image_etag(name)}"'
+            return Response(status=304, headers=headers)
+
+    # deletions on other nodes reach the local image cache through the listener
+    start_content_listener()
+    # negotiated formats may not exist (yet); the requested name is the fallback
+    for name in candidates[:-1]:
+        if name in missing_variants:
+            continue
+        located = locate_image(name)
+        if located is not None:
+            break
+        missing_variants.add(name)
+    else:
+        name = filename
+        # a 304 sends no file, so a missing one would not show up as a 404 later
+        located = locate_image(name, must_exist=bool(request.if_modified_since))
+    if located is None:
+        return jsonify({'error': 'Not found'}), 404
+    path, accel_uri = located
+    headers['ETag'] = f'"{image_etag(name)}"'
+    if request.if_modified_since and not request.if_none_match:
+        # the bytes behind a stored name never change, so any copy is current
+        return Response(status=304, headers=headers)
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    if path is None:
+        # object store, not cached on this VM
+        if IMAGE_DELIVERY == 'redirect':
+            response = redirect(storage.presigned_url(name, S3_PRESIGN_EXPIRES))
+            # the presigned URL expires, so the redirect may only be cached briefly
+            response.headers['Cache-Control'] = f'private, max-age={S3_PRESIGN_EXPIRES // 2}'
+            if 'Vary' in headers:
+                response.headers['Vary'] = headers['Vary']
+            return response
+        try:
+            chunks = storage.stream(name)
+        except FileNotFoundError:
+            return jsonify({'error': 'Not found'}), 404
+        return Response(chunks, mimetype=mimetype, headers=headers)
+
+    if IMAGE_DELIVERY == 'x-accel-redirect':
+        # nginx serves the file (and handles Range) from an internal location
+        headers['X-Accel-Redirect'] = accel_uri
+        return Response(status=200, mimetype=mimetype, headers=headers)
+
+    # 'wsgi' wraps the open file for the server's sendfile path;
+    # 'x-sendfile' (USE_X_SENDFILE) makes this an empty response with X-Sendfile
+    try:
+        response = send_file(path, mimetype=mimetype, etag=image_etag(name),
+                             max_age=IMAGE_CACHE_MAX_AGE, conditional=True)
+    except FileNotFoundError:
+        return jsonify({'error': 'Not found'}), 404
+    response.headers.update(headers)
+    return response
+
+@app.route('/api/rotation', methods=['GET'])
+def get_rotation():
+    """
+    Ordered manifest of the next items the welcome page will show.
+
+    Query parameters (all optional):
+    - after: the 'next' cursor of the previous manifest
+    - count: items to return (default ROTATION_MANIFEST_SIZE)
+    """
+    try:
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    count = request.args.get('count', ROTATION_MANIFEST_SIZE, type=int)
+    if not 1 <= count <= ROTATION_MAX_MANIFEST_SIZE:
+        return jsonify({'error': f"count must be between 1 and {ROTATION_MAX_MANIFEST_SIZE}"}), 400
+
+    return serve_cached(RotationQuery(after, count), build_rotation)
+
+@app.route('/api/content', methods=['GET'])
+def get_content():
+    """
+    List content newest first.
+
+    Query parameters (all optional):
+    - fields: comma separated subset of CONTENT_FIELDS to return
+    - limit: page size (max MAX_PAGE_SIZE); omit everything for the full list
+    - after / before: cursors from the X-Next-Cursor / X-Prev-Cursor headers
+    - stream=1: send every matching row as NDJSON, one object per line
+    """
+    try:
+        query = parse_content_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if request.args.get('stream') in ('1', 'true'):
+        if query.before:
+            return jsonify({'error': 'stream does not support before'}), 400
+        chunks = stream_content(query, request_min_lsn())
+        try:
+            next(chunks)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        return Response(chunks, mimetype='application/x-ndjson')
+
+    return serve_cached(query, build_content_page)
+
+def build_content_page(conn, query):
+    """
+    serve_cached() builder for /api/content: (rows, headers, preload).
+    """
+    rows, next_cursor, prev_cursor = fetch_content(conn, query)
+    return rows, pagination_headers(query, next_cursor, prev_cursor), None
+
+def serve_cached(key, build):
+    """
+    Answer a read-only listing from content_cache, or build it.
+
+    build(conn, key) returns (payload, headers, preload) from a replica
+    that has seen the latest known write. Rebuilds of one key are
+    single-flight: concurrent misses wait and share the leader's entry.
+    """
+    start_content_listener()
+    request_lsn = request_min_lsn()
+    use_cache = content_cache.serves(request_lsn)
+    entry, fresh = content_cache.get(key) if use_cache else (None, False)
+    if fresh:
+        return serve_materialized(entry)
+
+    flight = None
+    if use_cache:
+        flight, leader = content_cache.join(key)
+        if not leader:
+            # another request is rebuilding this listing: share its result
+            flight.done.wait()
+            if flight.entry is not None:
+                return serve_materialized(flight.entry)
+            flight = None
+    built = None
+    try:
+        response, built = fill_cached(key, build, request_lsn, use_cache, entry)
+        return response
+    finally:
+        if flight is not None:
+            content_cache.land(key, flight, built)
+
+def fill_cached(key, build, request_lsn, use_cache, entry):
+    """
+    Build (or revalidate) a listing response from the database.
+
+    Returns (response, Materialized or None); the entry is also stored in
+    content_cache when use_cache is set and the body is small enough.
+    """
+    generation = content_cache.generation
+    try:
+        # For reads we allow replica (one that has seen the latest known write)
+        with db_connection(readonly=True, min_lsn=later_lsn(request_lsn, content_cache.min_lsn)) as conn:
+            # read the version first: if rows change in between, the older
+            # version only makes the validator expire sooner
+            version, last_modified = fetch_content_version(conn)
+            if entry is not None and entry.version == version:
+                # expired but unchanged: keep the bytes we already have
+                content_cache.refresh(key, generation)
+                return serve_materialized(entry), entry
+            etag = content_etag(version, key)
+            if is_not_modified(etag, last_modified):
+                return Response(status=304, headers=validator_headers(etag, last_modified)), None
+            payload, headers, preload = build(conn, key)
+    except Exception as e:
+        return (jsonify({'error': str(e)}), 500), None
+
+    headers.update(validator_headers(etag, last_modified))
+    body = jsonify(payload).get_data()
+    # compressing a body the cache will refuse would be thrown away (and redone) per request
+    cacheable = use_cache and content_cache.fits(len(body))
+    entry = materialize(body, headers, etag, last_modified, version, compress=cacheable, preload=preload)
+    if cacheable:
+        content_cache.put(key, entry, generation)
+    return serve_materialized(entry), entry
+
+def insert_content(cur, quote, upload, original_name):
+    """
+    Put an upload in place and insert its content row, inside the caller's
+    transaction. Returns the body of the 201 response.
+    """
+    unique_filename = upload_filename(upload, original_name)
+    placed = acquire_image(cur, upload, unique_filename)
+    try:
+        # a new image is processed by the worker; a duplicate
+        # shares the state of the rows already using it
+        cur.execute(
+            '''INSERT INTO content (quote, image_filename, processing_state)
+               VALUES (%s, %s, CASE WHEN %s THEN 'pending' ELSE COALESCE(
+                   (SELECT processing_state FROM content WHERE image_filename = %s LIMIT 1),
+                   'done') END)
+               RETURNING id, processing_state''',
+            (quote, unique_filename, placed, unique_filename)
+        )
+        new_id, processing_state = cur.fetchone()
+        if placed:
+            enqueue_job(cur, 'process_image', {'filename': unique_filename})
+    except Exception:
+        # If insert failed, delete the placed file (still under
+        # the images row lock) to avoid an orphan
+        if placed:
+            try:
+                storage.delete(unique_filename)
+            except Exception:
+                pass
+        raise
+    return {
+        'id': new_id,
+        'message': 'Content added successfully',
+        'image_url': f"/images/{unique_filename}",
+        'processing_state': processing_state,
+        'sha256': upload.sha256
+    }
+
+def content_created(created, lsn):
+    response = jsonify(created)
+    response.status_code = 201
+    return with_consistency_token(response, lsn)
+
+# -------- Batch import --------
+BatchItem = namedtuple('BatchItem', 'quote original_name upload error')
+
+def batch_item_error(quote, original_name, size):
+    # manifest.json entries can hold any JSON value
+    if not quote:
+        return 'Quote is required'
+    if not isinstance(quote, str):
+        return 'quote must be a string'
+    if not isinstance(original_name, str):
+        return 'image must be a file name'
+    if not allowed_file(original_name):
+        return 'Invalid file type. Only images allowed'
+    if size > MAX_FILE_SIZE:
+        return f"File exceeds {MAX_FILE_SIZE // (1024 * 1024)}MB limit"
+    return None
+
+def batch_items_from_form(form, files, pool):
+    """
+    Pair repeated 'quote' fields with repeated 'image' files, in order.
+
+    The parser already streamed each image into its temp file; the fsyncs,
+    which dominate on NFS, run in parallel here.
+    """
+    quotes, images = form.getlist('quote'), files.getlist('image')
+    if len(quotes) != len(images):
+        raise ValueError('Send one quote per image')
+    if len(images) > BATCH_MAX_FILES:
+        raise ValueError(f"At most {BATCH_MAX_FILES} images per multipart batch; send a zip archive instead")
+    list(pool.map(lambda image: image.stream.stage(), images))
+    return [BatchItem(quote, image.filename, image.stream, batch_item_error(quote, image.filename, image.stream.size))
+            for quote, image in zip(quotes, images)]
+
+def batch_items_from_archive(archive, pool):
+    """
+    Read manifest.json ([{"quote": ..., "image": <member name>}, ...]) from a
+    zip archive and extract the images into upload temp files in parallel,
+    each worker thread reading through its own ZipFile.
+    """
+    archive.stage()
+    try:
+        zf = zipfile.ZipFile(archive.temp_path)
+    except zipfile.BadZipFile:
+        raise ValueError('Archive is not a zip file')
+    with zf:
+        try:
+            manifest = json.loads(zf.read('manifest.json'))
+        except KeyError:
+            raise ValueError('Archive has no manifest.json')
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"Archive is damaged: {e}")
+        members = {info.filename: info for info in zf.infolist()}
+    if not isinstance(manifest, list) or not all(isinstance(entry, dict) for entry in manifest):
+        raise ValueError('manifest.json must be a list of {"quote": ..., "image": ...} objects')
+    if len(manifest) > BATCH_MAX_ITEMS:
+        raise ValueError(f"At most {BATCH_MAX_ITEMS} items per batch")
+
+    def extract(zf, entry):
+        quote, name = entry.get('quote'), entry.get('image')
+        info = members.get(name) if isinstance(name, str) else None
+        error = batch_item_error(quote, name, info.file_size if info else 0)
+        if error is None and info is None:
+            error = f"{name} not found in archive"
+        if error is not None:
+            return BatchItem(quote, name, None, error)
+        upload = UploadFile()
+        try:
+            with zf.open(info) as member:
+                shutil.copyfileobj(member, upload)
+            upload.stage()
+        except Exception as e:
+            upload.close()
+            return BatchItem(quote, name, None, getattr(e, 'description', str(e)))
+        return BatchItem(quote, name, upload, None)
+
+    def extract_slice(indexes):
+        with zipfile.ZipFile(archive.temp_path) as zf:
+            return [(i, extract(zf, manifest[i])) for i in indexes]
+
+    items = [None] * len(manifest)
+    slices = [range(start, len(manifest), BATCH_WRITE_WORKERS) for start in range(BATCH_WRITE_WORKERS)]
+    for extracted in pool.map(extract_slice, slices):
+        for i, item in extracted:
+            items[i] = item
+    return items
+
+def insert_batch(cur, items, pool):
+    """
+    insert_content() for many items at once, in the caller's transaction:
+    one statement for the image references, parallel renames for the new
+    files, one multi-row INSERT for the content rows and one for the jobs.
+    Returns a result per item, in input order.
+    """
+    valid = [(i, item) for i, item in enumerate(items) if item.error is None]
+    names = {i: upload_filename(item.upload, item.original_name) for i, item in valid}
+    counts = Counter(names.values())
+    placed = set(acquire_images(cur, counts)) if counts else set()
+    # duplicates inside the batch share one file; the first copy is put in place
+    sources = {}
+    for i, item in valid:
+        sources.setdefault(names[i], item.upload)
+
+    try:
+        list(pool.map(lambda filename: sources[filename].commit(filename), placed))
+        states = {}
+        existing = [filename for filename in counts if filename not in placed]
+        if existing:
+            cur.execute(
+                '''SELECT DISTINCT ON (image_filename) image_filename, processing_state
+                   FROM content WHERE image_filename = ANY(%s)''',
+                (existing,)
+            )
+            states = dict(cur.fetchall())
+        ids = execute_values(
+            cur, 'INSERT INTO content (quote, image_filename, processing_state) VALUES %s RETURNING id',
+            [(item.quote, names[i], 'pending' if names[i] in placed else states.get(names[i], 'done'))
+             for i, item in valid],
+            page_size=1000, fetch=True
+        ) if valid else []
+        if placed:
+            enqueue_jobs(cur, 'process_image', [{'filename': filename} for filename in sorted(placed)])
+    except Exception:
+        # same as insert_content(): don't leave files behind for rows that never committed
+        for filename in placed:
+            try:
+                storage.delete(filename)
+            except Exception:
+                pass
+        raise
+
+    results = [{'index': i, 'error': item.error} for i, item in enumerate(items)]
+    for (i, item), (new_id,) in zip(valid, ids):
+        results[i] = {
+            'index': i,
+            'id': new_id,
+            'image_url': f"/images/{names[i]}",
+            'processing_state': 'pending' if names[i] in placed else states.get(names[i], 'done'),
+            'sha256': item.upload.sha256
+        }
+    return results
+
+@app.route('/api/content', methods=['POST'])
+def add_content():
+    try:
+        # Basic validations
+        if 'image' not in request.files:
+            return jsonify({'error': 'No image file provided'}), 400
+
+        file = request.files['image']
+        quote = request.form.get('quote')
+
+        if not quote:
+            return jsonify({'error': 'Quote is required'}), 400
+
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'Invalid file type. Only images allowed'}), 400
+
+        # Insert into DB (requires writable node) and move the already
+        # streamed upload into place within the same transaction
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    created = insert_content(cur, quote, file.stream, file.filename)
+            lsn = current_wal_lsn(conn)
+        content_cache.invalidate(parse_lsn(lsn))
+        return content_created(created, lsn)
+
+    except HTTPException as e:
+        # e.g. 413 raised while the upload was streaming in
+        return jsonify({'error': e.description}), e.code
+    except Exception as e:
+        # Return any error
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/content/batch', methods=['POST'])
+def import_content():
+    """
+    Bulk import: repeated quote/image multipart fields (paired in order), or
+    an 'archive' zip holding the images and a manifest.json.
+
+    Invalid items are skipped and reported in the per-item results; every
+    valid item is inserted in a single transaction.
+    """
+    try:
+        # this request only: a batch may be far larger than one upload, but
+        # each multipart image keeps the MAX_FILE_SIZE limit; only the archive may be bigger
+        request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+        request.max_form_parts = 2 * BATCH_MAX_FILES + 10
+        request.max_file_sizes = {'archive': BATCH_MAX_CONTENT_LENGTH}
+
+        with ThreadPoolExecutor(max_workers=BATCH_WRITE_WORKERS, thread_name_prefix='batch-import') as pool:
+            if 'archive' in request.files:
+                items = batch_items_from_archive(request.files['archive'].stream, pool)
+            else:
+                items = batch_items_from_form(request.form, request.files, pool)
+            if not items:
+                return jsonify({'error': 'No items to import'}), 400
+            try:
+                with db_connection(readonly=False) as conn:
+                    with conn:
+                        with conn.cursor() as cur:
+                            results = insert_batch(cur, items, pool)
+                    lsn = current_wal_lsn(conn)
+            finally:
+                for item in items:
+                    if item.upload is not None:
+                        item.upload.close()
+        content_cache.invalidate(parse_lsn(lsn))
+
+        imported = sum('id' in result for result in results)
+        response = jsonify({'imported': imported, 'failed': len(results) - imported, 'results': results})
+        response.status_code = 201 if imported else 400
+        return with_consistency_token(response, lsn)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/content/<int:item_id>', methods=['DELETE'])
+def delete_content(item_id):
+    try:
+        # Need writable DB to delete row; the file goes with its last reference
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute('DELETE FROM content WHERE id = %s RETURNING image_filename', (item_id,))
+                    res = cur.fetchone()
+                    orphans = release_images(cur, {res[0]: 1}) if res else {}
+            lsn = current_wal_lsn(conn)
+        content_cache.invalidate(parse_lsn(lsn))
+        schedule_file_cleanup(orphans)
+
+        return with_consistency_token(jsonify({'message': 'Content deleted successfully'}), lsn)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def bulk_delete_sql(data):
+    """
+    WHERE clause and params for a bulk delete body: {"ids": [...]} or
+    {"filter": {"created_before", "created_after", "processing_state"}}.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Body must be a JSON object')
+    if 'ids' in data:
+        ids = data['ids']
+        # bool is a subclass of int, but true/false are not ids
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError('ids must be a list of integers')
+        if len(ids) > BULK_DELETE_MAX_ROWS:
+            raise ValueError(f"At most {BULK_DELETE_MAX_ROWS} ids per request")
+        return 'id = ANY(%s)', [ids]
+
+    conditions, params = [], []
+    criteria = data.get('filter') or {}
+    if not isinstance(criteria, dict):
+        raise ValueError('filter must be an object')
+    for key, condition in (('created_before', 'created_at < %s'), ('created_after', 'created_at >= %s')):
+        if key in criteria:
+            if not isinstance(criteria[key], str):
+                raise ValueError(f"{key} must be an ISO 8601 timestamp string")
+            conditions.append(condition)
+            params.append(datetime.fromisoformat(criteria[key]))
+    if 'processing_state' in criteria:
+        if not isinstance(criteria['processing_state'], str):
+            raise ValueError('processing_state must be a string')
+        conditions.append('processing_state = %s')
+        params.append(criteria['processing_state'])
+    if not conditions:
+        raise ValueError('Give ids or a filter with created_before, created_after or processing_state')
+    return ' AND '.join(conditions), params
+
+@app.route('/api/content/bulk-delete', methods=['POST'])
+def bulk_delete_content():
+    """
+    Delete many items with one DELETE ... RETURNING; image files that lose
+    their last reference are unlinked in the background after commit.
+
+    At most BULK_DELETE_MAX_ROWS rows (lowest ids first) go per request, so
+    a broad filter cannot delete the whole table in one transaction;
+    'more' tells the caller to send the request again.
+    """
+    try:
+        where, params = bulk_delete_sql(request.get_json(silent=True) or {})
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        f'''DELETE FROM content
+                            WHERE id IN (SELECT id FROM content WHERE {where} ORDER BY id LIMIT %s)
+                            RETURNING id, image_filename''',
+                        params + [BULK_DELETE_MAX_ROWS]
+                    )
+                    rows = cur.fetchall()
+                    more = False
+                    if len(rows) == BULK_DELETE_MAX_ROWS:
+                        cur.execute(f'SELECT EXISTS (SELECT 1 FROM content WHERE {where})', params)
+                        more = cur.fetchone()[0]
+                    orphans = release_images(cur, Counter(filename for _, filename in rows)) if rows else {}
+            lsn = current_wal_lsn(conn)
+        content_cache.invalidate(parse_lsn(lsn))
+        schedule_file_cleanup(orphans)
+
+        message = f"Deleted {len(rows)} items"
+        if more:
+            message += '; more items match, send the request again'
+        response = jsonify({
+            'deleted': len(rows),
+            'more': more,
+            'ids': [item_id for item_id, _ in rows],
+            'message': message
+        })
+        return with_consistency_token(response, lsn)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """
+    Start a resumable upload: {"filename": ..., "size": ...} -> session id.
+
+    The client then PUTs chunks to /api/uploads/<id> with an Upload-Offset
+    header, checks progress with GET after a failure, and finishes with
+    POST /api/uploads/<id>/finalize carrying the quote.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        original_name = data.get('filename') or ''
+        size = data.get('size')
+
+        if not allowed_file(original_name):
+            return jsonify({'error': 'Invalid file type. Only images allowed'}), 400
+        if not isinstance(size, int) or size <= 0:
+            return jsonify({'error': 'size must be a positive integer'}), 400
+        if size > RESUMABLE_MAX_FILE_SIZE:
+            return jsonify({'error': f"File exceeds {RESUMABLE_MAX_FILE_SIZE // (1024 * 1024)}MB limit"}), 413
+
+        upload_id = uuid.uuid4()
+        os.makedirs(storage.staging_dir(), exist_ok=True)
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    expire_upload_sessions(cur)
+                    cur.execute(
+                        'INSERT INTO uploads (id, original_name, size) VALUES (%s, %s, %s)',
+                        (str(upload_id), original_name, size)
+                    )
+                    open(upload_part_path(upload_id), 'xb').close()
+
+        response = jsonify({
+            'id': str(upload_id),
+            'size': size,
+            'received': 0,
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            'max_chunk_size': UPLOAD_CHUNK_MAX
+        })
+        response.status_code = 201
+        response.headers['Location'] = url_for('upload_status', upload_id=upload_id)
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def fetch_upload(cur, upload_id, lock=False):
+    cur.execute(
+        'SELECT original_name, size, received FROM uploads WHERE id = %s' + (' FOR UPDATE' if lock else ''),
+        (str(upload_id),)
+    )
+    return cur.fetchone()
+
+@app.route('/api/uploads/<uuid:upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    try:
+        # sessions change on every chunk; read them from the primary
+        with db_connection(readonly=False) as conn:
+            with conn.cursor() as cur:
+                session = fetch_upload(cur, upload_id)
+        if session is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        return jsonify({'id': str(upload_id), 'size': session[1], 'received': session[2]})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads/<uuid:upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Write the request body at the byte offset given in Upload-Offset.
+
+    The offset may repeat bytes already received (a retried chunk) but not
+    leave a gap; a 409 reports where to continue from.
+    """
+    try:
+        request.max_content_length = UPLOAD_CHUNK_MAX
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None or offset < 0:
+            return jsonify({'error': 'Upload-Offset header is required'}), 400
+
+        with db_connection(readonly=False) as conn:
+            with conn.cursor() as cur:
+                session = fetch_upload(cur, upload_id)
+        if session is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        _, size, received = session
+        if offset > received:
+            return jsonify({'error': 'Upload-Offset is past the received bytes', 'received': received}), 409
+
+        write_chunk(upload_id, offset, size, request.stream)
+        with db_connection(readonly=False) as conn:
+            with conn.cursor() as cur:
+                _, size, received = fetch_upload(cur, upload_id)
+        return jsonify({'id': str(upload_id), 'size': size, 'received': received})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads/<uuid:upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """
+    Turn a complete upload into a content row, like POST /api/content.
+    """
+    try:
+        data = request.get_json(silent=True) or request.form
+        quote = data.get('quote')
+        if not quote:
+            return jsonify({'error': 'Quote is required'}), 400
+
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    # the row lock serialises concurrent finalize calls
+                    session = fetch_upload(cur, upload_id, lock=True)
+                    if session is None:
+                        return jsonify({'error': 'Upload not found'}), 404
+                    original_name, size, received = session
+                    if received < size:
+                        return jsonify({'error': 'Upload is incomplete', 'size': size, 'received': received}), 409
+                    upload = AssembledUpload(upload_part_path(upload_id))
+                    created = insert_content(cur, quote, upload, original_name)
+                    cur.execute('DELETE FROM uploads WHERE id = %s', (str(upload_id),))
+            # only now: on a rollback the session and its file stay for a retry
+            upload.close()
+            lsn = current_wal_lsn(conn)
+        content_cache.invalidate(parse_lsn(lsn))
+        return content_created(created, lsn)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads/<uuid:upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    try:
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute('DELETE FROM uploads WHERE id = %s RETURNING id', (str(upload_id),))
+                    found = cur.fetchone() is not None
+        if not found:
+            return jsonify({'error': 'Upload not found'}), 404
+        try:
+            os.remove(upload_part_path(upload_id))
+        except FileNotFoundError:
+            pass
+        return jsonify({'message': 'Upload aborted'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/time')
+def get_time():
+    now = datetime.now()
+    return jsonify({
+        'time': now.strftime('%H:%M:%S'),
+        'date': now.strftime('%B %d, %Y'),
         'greeting': get_greeting(now.hour)
     })
 
@@ -322,31 +2952,36 @@ def health_check():
         'hostname': hostname,
         'database_index': None,
         'db_host': None,
-        'content_count': None
+        'content_count': None,
+        'storage': storage.name
     }
 
-    conn = None
     try:
         # We try readonly True to avoid forcing failover for this check
-        conn = get_db(readonly=True)
-        status['database_index'] = current_db_index + 1
-        status['db_host'] = DB_CONFIGS[current_db_index]['host']
+        with db_connection(readonly=True) as conn:
+            status['database_index'] = conn.node_index + 1
+            status['db_host'] = DB_CONFIGS[conn.node_index]['host']
 
-        with conn.cursor() as cur:
-            # Use a simple read
-            cur.execute('SELECT COUNT(*) FROM content')
-            cnt = cur.fetchone()[0]
-            status['content_count'] = cnt
+            with conn.cursor() as cur:
+                # Use a simple read
+                cur.execute('SELECT COUNT(*) FROM content')
+                cnt = cur.fetchone()[0]
+                status['content_count'] = cnt
         status['status'] = 'healthy'
-        conn.close()
     except Exception as e:
         status['status'] = 'degraded'
         status['error'] = str(e)
-        if conn:
-            try:
-                conn.close()
-            except Exception:
-                pass
+
+    topology = _monitor.topology if _monitor is not None else None
+    if topology is not None:
+        status['nodes'] = [
+            {
+                'host': st.host,
+                'role': 'down' if not st.reachable else ('replica' if st.read_only else 'primary'),
+                'lag_seconds': st.lag
+            }
+            for st in topology.nodes
+        ]
 
     return jsonify(status)
 
@@ -366,7 +3001,7 @@ if __name__ == '__main__':
     print(f"Starting Flask App on {hostname}")
     print("=" * 60)
 
-    ensure_upload_folder()
+    ensure_storage()
 
     # Try to initialize DB (tries to use a writable node)
     init_db()
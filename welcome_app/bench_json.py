@@ -0,0 +1,71 @@
+"""
+Microbenchmark: JSON encode throughput of /api/content payloads per backend.
+
+Builds RealDictRow rows shaped like the content listing and times how long
+each AppJSONProvider backend takes to turn them into a response body.
+
+Usage:
+    python3 bench_json.py                # 10, 1k and 100k rows
+    python3 bench_json.py 500 20000      # custom row counts
+"""
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from psycopg2.extras import RealDictRow
+
+from app import app, orjson, AppJSONProvider
+
+ROW_COUNTS = (10, 1_000, 100_000)
+MIN_SECONDS = 1.0  # keep repeating a case until it has run this long
+
+
+def make_rows(count):
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    rows = []
+    for i in range(count):
+        row = RealDictRow()
+        filename = f"{uuid.uuid4()}.jpg"
+        row['id'] = count - i
+        row['quote'] = f"Quote number {i}: the best way to predict the future is to create it."
+        row['image_filename'] = filename
+        row['created_at'] = start + timedelta(seconds=count - i, microseconds=i)
+        row['image_url'] = f"/images/{filename}"
+        rows.append(row)
+    return rows
+
+
+def bench(provider, rows):
+    """
+    Returns (seconds per encode, body size in bytes).
+    """
+    with app.app_context():
+        runs = 0
+        started = time.perf_counter()
+        while True:
+            body = provider.response(rows).get_data()
+            runs += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= MIN_SECONDS:
+                return elapsed / runs, len(body)
+
+
+def main(counts):
+    backends = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    if orjson is None:
+        print("orjson not installed — only the stdlib backend is measured")
+
+    print(f"{'rows':>8} {'backend':>8} {'ms/encode':>10} {'rows/s':>12} {'MB/s':>8} {'speedup':>8}")
+    for count in counts:
+        rows = make_rows(count)
+        baseline = None
+        for backend in backends:
+            per_run, size = bench(AppJSONProvider(app, backend=backend), rows)
+            baseline = baseline or per_run
+            print(f"{count:>8} {backend:>8} {per_run * 1000:>10.3f} {count / per_run:>12,.0f} "
+                  f"{size / per_run / 1e6:>8.1f} {baseline / per_run:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or ROW_COUNTS)
@@ -0,0 +1,64 @@
+"""
+Online migration of the upload folder from the flat layout to the sharded one.
+
+Moves every image stored directly in UPLOAD_FOLDER to
+<name[0:2]>/<name[2:4]>/<name>, in batches with a pause in between so the
+NFS server keeps serving traffic. The app stays up throughout: with
+STORAGE_FLAT_FALLBACK it finds each file at either path, and every move is
+a single atomic rename. Safe to interrupt and run again; when a run reports
+0 files, set STORAGE_FLAT_FALLBACK = False on every node.
+
+Usage:
+    python3 migrate_layout.py                        # migrate
+    python3 migrate_layout.py --dry-run              # only count flat files
+    python3 migrate_layout.py --batch-size 500 --pause 1.0
+"""
+import argparse
+import os
+import time
+
+import app as app_module
+from app import ensure_storage, log
+
+
+def flat_files(root):
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                yield entry.name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move flat image files into the sharded layout.")
+    parser.add_argument('--batch-size', type=int, default=1000, help="files moved between pauses")
+    parser.add_argument('--pause', type=float, default=0.5, help="seconds to sleep between batches")
+    parser.add_argument('--dry-run', action='store_true', help="count flat files without moving them")
+    args = parser.parse_args()
+
+    ensure_storage()
+    storage = app_module.storage
+    if not getattr(storage, 'sharded', False):
+        log("✗ Storage is not file based with STORAGE_LAYOUT = 'sharded'; nothing to migrate")
+        return 1
+
+    found = moved = 0
+    started = time.monotonic()
+    for name in flat_files(storage.root):
+        found += 1
+        if args.dry_run:
+            continue
+        if storage.relocate(name):
+            moved += 1
+        if found % args.batch_size == 0:
+            log(f"✓ Moved {moved} files ({moved / (time.monotonic() - started):.0f}/s)")
+            time.sleep(args.pause)
+
+    if args.dry_run:
+        log(f"✓ {found} flat files to migrate in {storage.root}")
+    else:
+        log(f"✓ Done: moved {moved} of {found} flat files in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
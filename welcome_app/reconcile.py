@@ -0,0 +1,227 @@
+"""
+Reconcile the image store with the database.
+
+Streams the store listing (storage.scan()) and every file the database
+expects (each content.image_filename plus the variants recorded in images)
+in the same sorted order, and merge-joins the two like `comm`. Memory stays
+constant however many files there are: the names are read in keyset pages
+of STREAM_ITERSIZE rows (one short query each, so no transaction stays open
+for the length of the scan), and the sharded layout is listed one leaf
+directory at a time.
+
+It reports:
+    orphan <name>            stored file nothing refers to (disk leak)
+    missing <name>           content rows whose image is gone (404 backgrounds)
+    missing-variant <name>   variant recorded in images.variants but not stored
+
+Files modified in the last --min-age seconds are never reported as orphans:
+uploads and the job worker put files in place before their rows commit.
+
+Usage:
+    python3 reconcile.py                   # report only
+    python3 reconcile.py --repair          # delete orphans, regenerate missing variants
+    python3 reconcile.py --repair --delete-missing   # ... and delete content rows with no image
+"""
+import argparse
+import time
+from collections import Counter
+
+import app as app_module
+from app import (
+    STORAGE_BACKEND, STREAM_ITERSIZE, db_connection, enqueue_jobs, ensure_storage, log,
+    release_images, remove_image_files, variant_filenames
+)
+
+
+def referenced_images(page_size=STREAM_ITERSIZE):
+    """
+    Yield (filename, variants) for every distinct content.image_filename in
+    byte order (COLLATE "C", like storage.scan()).
+
+    Keyset pages, each its own short query on a pooled connection, so a
+    scan of millions of rows never holds a snapshot open on the primary.
+    """
+    after = ''
+    while True:
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute('''
+                        SELECT f.filename, i.variants
+                        FROM (SELECT DISTINCT image_filename COLLATE "C" AS filename
+                              FROM content
+                              WHERE image_filename COLLATE "C" > %s
+                              ORDER BY 1
+                              LIMIT %s) AS f
+                        -- back to the default collation, so images_pkey is used
+                        LEFT JOIN images i ON i.filename = f.filename COLLATE "default"
+                        ORDER BY f.filename
+                    ''', (after, page_size))
+                    rows = cur.fetchall()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1][0]
+
+
+def expected_files(images):
+    """
+    Yield (name, original) for every file the database expects, sorted by
+    name, from referenced_images()-style (filename, variants) rows. original
+    is the content.image_filename the file belongs to (the name itself for
+    originals).
+
+    A file's variants start with its name, so all names of one stem (the
+    same bytes may be stored as .jpg and .png) sort next to each other;
+    each stem's names are collected and sorted before they are yielded,
+    which keeps the stream in order. Each name is yielded once.
+    """
+    group, stem = {}, None
+    for filename, variants in images:
+        if filename.rsplit('.', 1)[0] != stem:
+            yield from sorted(group.items())
+            group, stem = {}, filename.rsplit('.', 1)[0]
+        group.setdefault(filename, filename)
+        for name in variant_filenames(filename, variants):
+            group.setdefault(name, filename)
+    yield from sorted(group.items())
+
+
+def merge_join(stored, expected):
+    """
+    Yield ('orphan', name, mtime), ('missing', name, original) for every
+    name that is in only one of the two sorted streams.
+
+    A name listed twice in a row by stored is only counted once: a file
+    moved by migrate_layout.py during the scan shows up both in the flat
+    listing and in its shard.
+    """
+    def unique(files):
+        previous = None
+        for file in files:
+            if file[0] != previous:
+                previous = file[0]
+                yield file
+
+    stored = unique(stored)
+    file, want = next(stored, None), next(expected, None)
+    while file is not None or want is not None:
+        if want is None or (file is not None and file[0] < want[0]):
+            yield 'orphan', file[0], file[1]
+            file = next(stored, None)
+        elif file is None or want[0] < file[0]:
+            yield 'missing', want[0], want[1]
+            want = next(expected, None)
+        else:
+            file, want = next(stored, None), next(expected, None)
+
+
+class Repairs:
+    """
+    Collects findings and applies them in batches of batch_size.
+    """
+
+    def __init__(self, storage, batch_size, repair, delete_missing):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.repair = repair
+        self.delete_missing = delete_missing
+        self.orphans, self.missing, self.missing_variants = [], [], set()
+        self.done = Counter()
+
+    def add(self, kind, name, original=None):
+        if kind == 'orphan':
+            self.orphans.append(name)
+        elif kind == 'missing':
+            self.missing.append(name)
+        else:
+            self.missing_variants.add(original)
+        if len(self.orphans) + len(self.missing) + len(self.missing_variants) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.repair and self.orphans:
+            # claimed through placeholder rows, so a file re-uploaded since the scan is kept
+            self.done['orphans removed'] += remove_image_files({name: None for name in self.orphans})
+        if self.delete_missing and self.missing:
+            self.done['rows deleted'] += self.delete_rows(self.missing)
+        if self.repair and self.missing_variants:
+            self.done['variant jobs queued'] += self.requeue(self.missing_variants - set(self.missing))
+        self.orphans, self.missing, self.missing_variants = [], [], set()
+
+    def delete_rows(self, filenames):
+        # the file may have come back (re-upload, NFS hiccup) since it was listed
+        filenames = [f for f in filenames if not self.storage.exists(f)]
+        if not filenames:
+            return 0
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute('DELETE FROM content WHERE image_filename = ANY(%s) RETURNING image_filename',
+                                (filenames,))
+                    counts = Counter(row[0] for row in cur.fetchall())
+                    orphans = release_images(cur, counts) if counts else {}
+        if orphans:
+            remove_image_files(orphans)  # stray variants of the lost originals
+        return sum(counts.values())
+
+    def requeue(self, filenames):
+        # the original may be gone too (reported as missing), then there is nothing to regenerate from
+        filenames = sorted(f for f in filenames if self.storage.exists(f))
+        if not filenames:
+            return 0
+        with db_connection(readonly=False) as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute('UPDATE images SET variants = NULL WHERE filename = ANY(%s)', (filenames,))
+                    cur.execute("UPDATE content SET processing_state = 'pending' WHERE image_filename = ANY(%s)",
+                                (filenames,))
+                    enqueue_jobs(cur, 'process_image', [{'filename': f} for f in filenames])
+        return len(filenames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find (and fix) images without rows and rows without images.")
+    parser.add_argument('--repair', action='store_true',
+                        help="delete orphaned files and queue regeneration of missing variants")
+    parser.add_argument('--delete-missing', action='store_true',
+                        help="delete content rows whose image file is gone")
+    parser.add_argument('--min-age', type=float, default=3600,
+                        help="seconds a file must be unmodified before it counts as an orphan")
+    parser.add_argument('--batch-size', type=int, default=500, help="findings repaired per transaction")
+    parser.add_argument('--quiet', action='store_true', help="print only the summary")
+    args = parser.parse_args()
+
+    ensure_storage()
+    storage = app_module.storage
+    if storage.name != STORAGE_BACKEND:
+        # ensure_storage() fell back to ./uploads: every row would look missing
+        log(f"✗ Configured {STORAGE_BACKEND} storage is unavailable; refusing to reconcile")
+        return 1
+
+    repairs = Repairs(storage, args.batch_size, args.repair, args.delete_missing)
+    found = Counter()
+    cutoff = time.time() - args.min_age
+    started = time.monotonic()
+    for kind, name, extra in merge_join(storage.scan(), expected_files(referenced_images())):
+        if kind == 'orphan':
+            if extra > cutoff:
+                found['recent'] += 1
+                continue
+        elif name != extra:
+            kind = 'missing-variant'
+        found[kind] += 1
+        if not args.quiet:
+            print(f"{kind} {name}")
+        repairs.add(kind, name, extra)
+    repairs.flush()
+
+    summary = ', '.join(f"{found[k]} {k}" for k in ('orphan', 'missing', 'missing-variant', 'recent'))
+    log(f"✓ Reconciled in {time.monotonic() - started:.1f}s: {summary}")
+    if repairs.done:
+        log("✓ " + ', '.join(f"{n} {what}" for what, n in repairs.done.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,359 @@
+"""
+Storage drivers for uploaded images.
+
+Every driver stores opaque names ("<sha256>.jpg", "<stem>.thumb.webp", ...)
+and offers the same operations, so the app does not care whether the bytes
+live in a local directory, on the shared NFS export or in an S3-compatible
+object store:
+
+    put(name, source_path)   move a finished local temp file into storage
+    get(name)                whole object as bytes
+    stream(name)             iterator of chunks (opened eagerly, so a missing
+                             object raises FileNotFoundError right away)
+    delete(name)             no error if already gone
+    exists(name)
+    presigned_url(name)      time-limited direct URL, or None
+    path(name)               local file path, or None for object stores
+    scan()                   (name, mtime) of every stored object, in name order
+
+Uploads are staged in staging_dir() first; put() then only has to rename
+(file drivers) or upload (S3) the finished file.
+"""
+import os
+import heapq
+import tempfile
+import mimetypes
+from contextlib import contextmanager
+from operator import itemgetter
+
+from werkzeug.security import safe_join
+
+try:
+    import boto3  # optional: only the s3 driver needs it
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class StorageDriver:
+    """
+    Base class; see the module docstring for the contract.
+    """
+
+    name = None
+
+    def check(self):
+        """
+        Make sure the store is usable (directories exist, bucket reachable); raise if not.
+        """
+        os.makedirs(self.staging_dir(), exist_ok=True)
+
+    def staging_dir(self):
+        raise NotImplementedError
+
+    def put(self, name, source_path):
+        raise NotImplementedError
+
+    def open(self, name):
+        """
+        Readable binary file object for name; raises FileNotFoundError.
+        """
+        raise NotImplementedError
+
+    def get(self, name):
+        f = self.open(name)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def stream(self, name, chunk_size=CHUNK_SIZE):
+        f = self.open(name)
+        return self._chunks(f, chunk_size)
+
+    @staticmethod
+    def _chunks(f, chunk_size):
+        try:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+        finally:
+            f.close()
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def presigned_url(self, name, expires=3600):
+        return None
+
+    def path(self, name):
+        return None
+
+    def scan(self):
+        """
+        Yield (name, mtime) for every stored object in code point order, which
+        is the byte order PostgreSQL uses for COLLATE "C". Dot files (staging
+        directories, partial downloads) are skipped.
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def local_copy(self, name):
+        """
+        A local file path with name's bytes for the duration of the block:
+        the stored file itself when there is one, else a temp download.
+        """
+        path = self.path(name)
+        if path is not None:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(name)
+            yield path
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.staging_dir(), suffix='.download')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in self.stream(name):
+                    out.write(chunk)
+            yield tmp
+        finally:
+            os.remove(tmp)
+
+
+class LocalStorage(StorageDriver):
+    """
+    Files in a directory on a local disk; staging lives inside it so put()
+    is an atomic rename, followed by a directory fsync to make it durable.
+
+    With sharded=True a name is stored as <name[0:2]>/<name[2:4]>/<name>,
+    so no directory grows past a few hundred entries even with millions of
+    images (variants share their original's directory). flat_fallback also
+    finds files still at <name>, for stores part way through relocate().
+    """
+
+    name = 'local'
+
+    def __init__(self, root, staging_dir=None, incoming_dir='.incoming', sharded=False, flat_fallback=False):
+        self.root = root
+        self._staging_dir = staging_dir or os.path.join(root, incoming_dir)
+        self.sharded = sharded
+        self.flat_fallback = sharded and flat_fallback
+
+    def check(self):
+        os.makedirs(self.root, mode=0o755, exist_ok=True)
+        super().check()
+
+    def staging_dir(self):
+        return self._staging_dir
+
+    def shard_key(self, name):
+        return f"{name[0:2]}/{name[2:4]}/{name}" if self.sharded else name
+
+    def key(self, name):
+        """
+        Path of name relative to root (also its X-Accel-Redirect suffix).
+        """
+        key = self.shard_key(name)
+        if self.flat_fallback and not os.path.exists(os.path.join(self.root, key)) \
+                and os.path.exists(os.path.join(self.root, name)):
+            return name
+        return key
+
+    def _join(self, key):
+        path = safe_join(self.root, key)
+        if path is None:
+            raise FileNotFoundError(key)
+        return path
+
+    def path(self, name):
+        return self._join(self.key(name))
+
+    def put(self, name, source_path):
+        path = self._join(self.shard_key(name))
+        if self.sharded:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+        self._sync_dir(os.path.dirname(path))
+
+    def relocate(self, name):
+        """
+        Move a flat file to its sharded path; False if there was nothing to move.
+
+        The rename is atomic, so readers resolve the file at one path or the
+        other throughout. When the sharded copy already exists (content
+        addressed names have the same bytes) the flat one is just removed.
+        """
+        flat, target = self._join(name), self._join(self.shard_key(name))
+        if flat == target:
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            if os.path.exists(target):
+                os.remove(flat)
+            else:
+                os.rename(flat, target)
+        except FileNotFoundError:
+            return False  # deleted (or moved) meanwhile
+        return True
+
+    def _sync_dir(self, directory):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def delete(self, name):
+        # flat first: relocate() may move it to the sharded path at any moment
+        keys = [name, self.shard_key(name)] if self.flat_fallback else [self.shard_key(name)]
+        for key in keys:
+            try:
+                os.remove(self._join(key))
+            except FileNotFoundError:
+                pass
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def scan(self):
+        # sharded: one leaf directory in memory at a time; walking <ab>/<cd>/
+        # in sorted order yields names in sorted order. Flat files (all of them
+        # in the flat layout) are sorted in memory.
+        flat = self._sorted_files(self.root)
+        if not self.sharded:
+            return iter(flat)
+        return heapq.merge(flat, self._scan_shards(), key=itemgetter(0))
+
+    def _scan_shards(self):
+        for first in self._sorted_dirs(self.root):
+            for second in self._sorted_dirs(first):
+                yield from self._sorted_files(second)
+
+    @staticmethod
+    def _sorted_dirs(directory):
+        with os.scandir(directory) as it:
+            return sorted(entry.path for entry in it
+                          if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'))
+
+    @staticmethod
+    def _sorted_files(directory):
+        with os.scandir(directory) as it:
+            return sorted((entry.name, entry.stat().st_mtime) for entry in it
+                          if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'))
+
+
+class NFSStorage(LocalStorage):
+    """
+    LocalStorage on an NFS export mounted at (or above) root on every app VM.
+
+    check() refuses to run on an unmounted path, where uploads would quietly
+    land on one VM's local disk. Renames are synchronous on the server, so
+    no directory fsync is needed after put().
+    """
+
+    name = 'nfs'
+
+    def check(self):
+        if not self._mounted():
+            raise RuntimeError(f"{self.root} is not on a mounted filesystem")
+        super().check()
+
+    def _mounted(self):
+        directory = os.path.abspath(self.root)
+        while directory != os.path.dirname(directory):
+            if os.path.ismount(directory):
+                return True
+            directory = os.path.dirname(directory)
+        return False
+
+    def _sync_dir(self, directory):
+        pass
+
+
+class S3Storage(StorageDriver):
+    """
+    Objects in an S3-compatible bucket (AWS S3, MinIO, Ceph RGW, ...).
+
+    Uploads are staged on local disk (or a shared staging_dir, which
+    resumable uploads spread over several VMs need) and sent with boto3's
+    multipart-capable upload_file(). Objects can be streamed through the app
+    or handed out as presigned URLs.
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None,
+                 access_key=None, secret_key=None, staging_dir='/var/tmp/welcome_app/incoming'):
+        if boto3 is None:
+            raise RuntimeError("the s3 storage backend needs boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self._staging_dir = staging_dir
+        # custom endpoints (MinIO and friends) usually only do path-style addressing
+        config = Config(s3={'addressing_style': 'path'}) if endpoint_url else None
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key, config=config
+        )
+
+    def check(self):
+        self.client.head_bucket(Bucket=self.bucket)
+        super().check()
+
+    def staging_dir(self):
+        return self._staging_dir
+
+    def key(self, name):
+        return self.prefix + name
+
+    def put(self, name, source_path):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_file(source_path, self.bucket, self.key(name),
+                                ExtraArgs={'ContentType': content_type})
+        os.remove(source_path)
+
+    def open(self, name):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+        except ClientError as e:
+            if self._not_found(e):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def delete(self, name):
+        # deleting a missing key is not an error in S3
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+            return True
+        except ClientError as e:
+            if self._not_found(e):
+                return False
+            raise
+
+    def scan(self):
+        # ListObjectsV2 returns keys in UTF-8 byte order, one page at a time
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(self.prefix):]
+                if name and '/' not in name and not name.startswith('.'):
+                    yield name, obj['LastModified'].timestamp()
+
+    def presigned_url(self, name, expires=3600):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.key(name)}, ExpiresIn=expires
+        )
+
+    @staticmethod
+    def _not_found(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
@@ -0,0 +1,102 @@
+"""
+Ordering tests for reconcile.py: its merge join deletes files and rows, so
+both input streams must come out in exactly the order the join assumes.
+
+Needs no database or storage. Run with `python3 -m pytest` from welcome_app.
+"""
+import heapq
+import os
+import tempfile
+import unittest
+from operator import itemgetter
+
+from reconcile import expected_files, merge_join
+from storage import LocalStorage
+
+STEM_A = 'ab' + '0' * 62
+STEM_B = 'ab' + '1' * 62
+
+
+class MergeJoinTest(unittest.TestCase):
+
+    def join(self, stored, expected):
+        return list(merge_join(iter(stored), iter(expected)))
+
+    def test_reports_both_directions(self):
+        stored = [('a.jpg', 1), ('b.jpg', 2), ('d.jpg', 4)]
+        expected = [('b.jpg', 'b.jpg'), ('c.jpg', 'c.jpg'), ('d.jpg', 'd.jpg')]
+        self.assertEqual(self.join(stored, expected),
+                         [('orphan', 'a.jpg', 1), ('missing', 'c.jpg', 'c.jpg')])
+
+    def test_empty_sides(self):
+        self.assertEqual(self.join([], []), [])
+        self.assertEqual(self.join([('a.jpg', 1)], []), [('orphan', 'a.jpg', 1)])
+        self.assertEqual(self.join([], [('a.jpg', 'a.jpg')]), [('missing', 'a.jpg', 'a.jpg')])
+
+    def test_duplicate_stored_names_match_once(self):
+        # a file relocated mid-scan is listed flat and again in its shard
+        stored = [('a.jpg', 1), ('b.jpg', 2), ('b.jpg', 3), ('c.jpg', 4)]
+        expected = [('a.jpg', 'a.jpg'), ('b.jpg', 'b.jpg'), ('c.jpg', 'c.jpg')]
+        self.assertEqual(self.join(stored, expected), [])
+
+    def test_duplicate_orphan_reported_once(self):
+        stored = [('x.jpg', 1), ('x.jpg', 1)]
+        self.assertEqual(self.join(stored, []), [('orphan', 'x.jpg', 1)])
+
+
+class ExpectedFilesTest(unittest.TestCase):
+
+    def test_variants_sorted_after_their_original(self):
+        rows = [(f'{STEM_A}.jpg', {'thumb': ['jpg', 'webp'], '1280w': ['jpg']}),
+                (f'{STEM_B}.png', None)]
+        names = [name for name, _ in expected_files(rows)]
+        self.assertEqual(names, [f'{STEM_A}.jpg', f'{STEM_A}.jpg.1280w.jpg', f'{STEM_A}.jpg.thumb.jpg',
+                                 f'{STEM_A}.jpg.thumb.webp', f'{STEM_B}.png'])
+        self.assertEqual(dict(expected_files(rows))[f'{STEM_A}.jpg.thumb.webp'], f'{STEM_A}.jpg')
+
+    def test_same_stem_different_extensions_interleave(self):
+        # the same bytes uploaded as .jpg and .png share a stem, not their variants
+        rows = [(f'{STEM_A}.jpg', {'thumb': ['jpg', 'webp']}), (f'{STEM_A}.png', {'thumb': ['png', 'webp']})]
+        expected = list(expected_files(rows))
+        names = [name for name, _ in expected]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(names), 6)
+        self.assertEqual(dict(expected)[f'{STEM_A}.png.thumb.webp'], f'{STEM_A}.png')
+
+    def test_output_sorted_for_db_ordered_input(self):
+        # input in byte order, as referenced_images() returns it
+        filenames = sorted(['a-b.jpg', 'a.jpg', 'a0.png', 'ab.gif', 'b.jpg', 'a.png'])
+        rows = [(f, {'thumb': ['webp'], '1920w': ['webp']}) for f in filenames]
+        names = [name for name, _ in expected_files(rows)]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(names), len(set(names)))
+
+
+class LocalScanTest(unittest.TestCase):
+
+    def test_sharded_scan_is_sorted_and_merges_flat_files(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root, sharded=True, flat_fallback=True)
+            storage.check()
+            names = [f'{STEM_A}.jpg', f'{STEM_A}.jpg.thumb.webp', f'{STEM_B}.png', 'cd' + 'f' * 62 + '.gif']
+            for name in names:
+                path = storage._join(storage.shard_key(name))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, 'wb').close()
+            # not yet migrated, and a staging file that must be skipped
+            open(os.path.join(root, 'ab' + '2' * 62 + '.jpg'), 'wb').close()
+            open(os.path.join(storage.staging_dir(), 'upload.part'), 'wb').close()
+
+            scanned = [name for name, _ in storage.scan()]
+            self.assertEqual(scanned, sorted(names + ['ab' + '2' * 62 + '.jpg']))
+
+    def test_merged_duplicates_are_adjacent(self):
+        flat = [('b.jpg', 1)]
+        shards = [('a.jpg', 1), ('b.jpg', 1), ('c.jpg', 1)]
+        merged = heapq.merge(flat, shards, key=itemgetter(0))
+        self.assertEqual(list(merge_join(merged, iter([('a.jpg', 'a.jpg'), ('b.jpg', 'b.jpg'),
+                                                       ('c.jpg', 'c.jpg')]))), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
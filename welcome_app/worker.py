@@ -0,0 +1,114 @@
+"""
+Post-upload job worker: run one next to the Flask app on each VM.
+
+Claims jobs from the jobs table with FOR UPDATE SKIP LOCKED, so workers on
+every VM share one queue without blocking each other, runs the handler from
+JOB_HANDLERS and records the outcome. Between jobs it waits on
+LISTEN job_queued, polling every JOB_POLL_INTERVAL seconds as a fallback.
+
+Usage:
+    python3 worker.py        # JOB_WORKER_THREADS threads
+    python3 worker.py 4      # 4 threads
+"""
+import select
+import sys
+import threading
+import time
+
+from app import (
+    JOB_CHANNEL, JOB_HANDLERS, JOB_POLL_INTERVAL, JOB_WORKER_THREADS, LISTENER_RETRY_DELAY,
+    claim_job, db_connection, ensure_storage, fail_expired_jobs, fail_job, finish_job, get_db, init_db,
+    is_read_only, log,
+    _close_quietly
+)
+
+wakeup = threading.Event()
+
+
+def run_one():
+    """
+    Claim and run a single job. Returns False when the queue has nothing runnable.
+    """
+    with db_connection(readonly=False) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                fail_expired_jobs(cur)
+                job = claim_job(cur)
+    if job is None:
+        return False
+
+    job_id, kind, payload, attempts = job
+    handler, on_finished = JOB_HANDLERS.get(kind, (None, None))
+    error = None
+    try:
+        if handler is None:
+            raise Exception(f"unknown job kind '{kind}'")
+        handler(payload)
+    except Exception as e:
+        error = str(e)
+        log(f"✗ Job {job_id} ({kind}) attempt {attempts} failed: {e}")
+
+    with db_connection(readonly=False) as conn:
+        with conn:
+            with conn.cursor() as cur:
+                if error is None:
+                    finish_job(cur, job_id)
+                    on_finished(cur, payload)
+                elif fail_job(cur, job_id, attempts, error) and on_finished is not None:
+                    on_finished(cur, payload, failed=True)
+    return True
+
+
+def work():
+    while True:
+        try:
+            while run_one():
+                pass
+        except Exception as e:
+            log(f"✗ Worker error: {e}")
+        wakeup.wait(JOB_POLL_INTERVAL)
+        wakeup.clear()
+
+
+def listen():
+    """
+    Wake the worker threads as soon as a job is queued anywhere.
+    """
+    while True:
+        conn = None
+        try:
+            conn = get_db(readonly=False)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN {JOB_CHANNEL}')
+            log(f"✓ Listening for jobs on DB{conn.node_index+1}")
+            while True:
+                if select.select([conn], [], [], JOB_POLL_INTERVAL) == ([], [], []):
+                    # NOTIFY only reaches listeners on the primary
+                    if is_read_only(conn):
+                        raise Exception("listener node is no longer the primary")
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    wakeup.set()
+        except Exception as e:
+            log(f"✗ Job listener error: {e}")
+        if conn is not None:
+            _close_quietly(conn)
+        time.sleep(LISTENER_RETRY_DELAY)
+
+
+def main(threads):
+    ensure_storage()
+    init_db()
+    threading.Thread(target=listen, name='job-listener', daemon=True).start()
+    for i in range(threads):
+        threading.Thread(target=work, name=f'job-worker-{i+1}', daemon=True).start()
+    log(f"✓ Worker running with {threads} threads")
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else JOB_WORKER_THREADS)